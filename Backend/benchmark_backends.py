@@ -0,0 +1,157 @@
+"""Compare FLAN-T5 inference backends on a fixed corpus.
+
+Runs the same deterministic summarization prompts through each backend and
+reports per-document latency, batched throughput, and ROUGE drift of each
+backend's output against the pytorch fp32 baseline.
+
+    python benchmark_backends.py --corpus uploads --backends pytorch,int8,onnx
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+
+import torch
+import docx
+from PyPDF2 import PdfReader
+
+from model_backends import load_generation_model, BACKENDS, MODEL_NAME
+
+GENERATION = {"max_length": 200, "num_beams": 4, "no_repeat_ngram_size": 3}
+
+
+def read_document(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.pdf':
+        return " ".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    if extension == '.docx':
+        return "\n".join(paragraph.text for paragraph in docx.Document(path).paragraphs)
+    if extension == '.txt':
+        with open(path, 'r', encoding='utf-8', errors='ignore') as file:
+            return file.read()
+    return None
+
+
+def load_corpus(directory, max_chars, limit):
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        try:
+            text = read_document(os.path.join(directory, name))
+        except Exception as e:
+            print(f"skipping {name}: {e}", file=sys.stderr)
+            continue
+        text = re.sub(r'\s+', ' ', text or "").strip()
+        if text:
+            corpus.append((name, text[:max_chars]))
+        if limit and len(corpus) >= limit:
+            break
+    return corpus
+
+
+def rouge_scores(reference, candidate):
+    """ROUGE-1 and ROUGE-L F1 over lowercased whitespace tokens"""
+    ref, cand = reference.lower().split(), candidate.lower().split()
+    if not ref or not cand:
+        return 0.0, 0.0
+
+    def f1(overlap):
+        if not overlap:
+            return 0.0
+        precision, recall = overlap / len(cand), overlap / len(ref)
+        return 2 * precision * recall / (precision + recall)
+
+    counts = {}
+    for token in ref:
+        counts[token] = counts.get(token, 0) + 1
+    unigram_overlap = 0
+    for token in cand:
+        if counts.get(token):
+            counts[token] -= 1
+            unigram_overlap += 1
+
+    # Longest common subsequence, one row at a time
+    previous = [0] * (len(cand) + 1)
+    for ref_token in ref:
+        current = [0]
+        for j, cand_token in enumerate(cand, start=1):
+            current.append(previous[j - 1] + 1 if ref_token == cand_token else max(previous[j], current[j - 1]))
+        previous = current
+
+    return f1(unigram_overlap), f1(previous[-1])
+
+
+def generate(tokenizer, model, prompts):
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True, truncation=True, max_length=1024)
+    with torch.no_grad():
+        output_ids = model.generate(
+            input_ids=inputs.input_ids.to(model.device),
+            attention_mask=inputs.attention_mask.to(model.device),
+            **GENERATION
+        )
+    return tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+
+def benchmark(backend, corpus, batch_size):
+    started = time.monotonic()
+    tokenizer, model = load_generation_model(MODEL_NAME, backend)
+    load_seconds = time.monotonic() - started
+    prompts = [f"Summarize this:\n{text}" for _, text in corpus]
+
+    # Warm-up so one-time graph/allocator setup is not counted
+    generate(tokenizer, model, prompts[:1])
+
+    outputs, latencies = [], []
+    for prompt in prompts:
+        started = time.monotonic()
+        outputs.extend(generate(tokenizer, model, [prompt]))
+        latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    for i in range(0, len(prompts), batch_size):
+        generate(tokenizer, model, prompts[i:i + batch_size])
+    batched_seconds = time.monotonic() - started
+
+    return {
+        "backend": backend,
+        "load_s": load_seconds,
+        "p50_ms": 1000 * statistics.median(latencies),
+        "p95_ms": 1000 * sorted(latencies)[max(0, int(round(0.95 * len(latencies))) - 1)],
+        "docs_per_s": len(prompts) / batched_seconds,
+        "outputs": outputs
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default='uploads', help="directory of .pdf/.docx/.txt files")
+    parser.add_argument('--backends', default=",".join(BACKENDS), help="comma-separated backends, pytorch first")
+    parser.add_argument('--limit', type=int, default=10, help="maximum number of documents (0 = all)")
+    parser.add_argument('--max-chars', type=int, default=4000, help="characters of each document to summarize")
+    parser.add_argument('--batch-size', type=int, default=4, help="batch size for the throughput run")
+    args = parser.parse_args()
+
+    backends = [backend.strip() for backend in args.backends.split(',') if backend.strip()]
+    corpus = load_corpus(args.corpus, args.max_chars, args.limit)
+    if not corpus:
+        parser.error(f"no readable documents in {args.corpus}")
+    print(f"{len(corpus)} documents from {args.corpus}, {args.max_chars} chars each at most\n")
+
+    results = [benchmark(backend, corpus, args.batch_size) for backend in backends]
+    baseline = results[0]["outputs"]
+
+    print(f"{'backend':<10}{'load s':>9}{'p50 ms':>10}{'p95 ms':>10}{'docs/s':>9}{'ROUGE-1':>10}{'ROUGE-L':>10}")
+    for result in results:
+        scores = [rouge_scores(ref, cand) for ref, cand in zip(baseline, result["outputs"])]
+        rouge_1 = statistics.mean(score[0] for score in scores)
+        rouge_l = statistics.mean(score[1] for score in scores)
+        print(
+            f"{result['backend']:<10}{result['load_s']:>9.1f}{result['p50_ms']:>10.0f}{result['p95_ms']:>10.0f}"
+            f"{result['docs_per_s']:>9.2f}{rouge_1:>10.3f}{rouge_l:>10.3f}"
+        )
+    print(f"\nROUGE is measured against the {results[0]['backend']} outputs")
+
+
+if __name__ == '__main__':
+    main()
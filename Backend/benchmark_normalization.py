@@ -0,0 +1,106 @@
+"""Time text normalization on the documents in a corpus.
+
+Compares the previous cleaning (URL and whitespace regex passes) and sentence
+splitting (one lazy regex) with normalization.py. It also times re-sectioning a
+stored document for summarization with and without the sentence record saved at
+ingestion. Outputs of old and new are checked to be identical.
+
+    python benchmark_normalization.py --corpus uploads --repeat 5
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+from transformers import AutoTokenizer
+
+from benchmark_backends import read_document
+from chunking import SentenceChunker
+from normalization import normalize_text, sentence_spans
+from summarization import SUMMARY_SECTION_TOKENS
+
+# The implementations normalization.py replaced
+_OLD_SENTENCE = re.compile(r'\S.*?(?:[.!?]+(?=\s|$)|$)', re.DOTALL)
+
+
+def old_clean_text(text):
+    text = re.sub(r'http\S+|www\S+|https\S+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text[:100000]
+
+
+def old_sentence_spans(text):
+    return [match.span() for match in _OLD_SENTENCE.finditer(text)]
+
+
+def best_of(repeat, function, *args):
+    """Fastest of `repeat` runs in milliseconds, and the function's result"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return 1000 * min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default='uploads', help="directory of .pdf/.docx/.txt files")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per measurement, the fastest is reported")
+    parser.add_argument('--tokenizer', default='sentence-transformers/all-MiniLM-L6-v2',
+                        help="tokenizer used for chunking (the embedding model's)")
+    args = parser.parse_args()
+
+    splitter = SentenceChunker(AutoTokenizer.from_pretrained(args.tokenizer), SUMMARY_SECTION_TOKENS, overlap_tokens=0)
+    totals = {"clean": [0.0, 0.0], "sentences": [0.0, 0.0], "sections": [0.0, 0.0]}
+    documents = characters = 0
+
+    print(f"{'document':<40}{'chars':>9}{'clean ms':>18}{'sentences ms':>18}{'sections ms':>18}")
+    for name in sorted(os.listdir(args.corpus)):
+        try:
+            raw = read_document(os.path.join(args.corpus, name))
+        except Exception as e:
+            print(f"skipping {name}: {e}", file=sys.stderr)
+            continue
+        if not raw or not raw.strip():
+            continue
+
+        old_clean_ms, old_text = best_of(args.repeat, old_clean_text, raw)
+        new_clean_ms, text = best_of(args.repeat, normalize_text, raw, 100000)
+        old_split_ms, old_spans = best_of(args.repeat, old_sentence_spans, text)
+        new_split_ms, spans = best_of(args.repeat, sentence_spans, text)
+        if old_text != text or old_spans != spans:
+            print(f"{name}: outputs differ", file=sys.stderr)
+
+        # Sectioning for summaries: tokenize again vs reuse the record kept at ingestion
+        record = []
+        for _ in splitter.chunk_pages([(1, text)], sentences=record):
+            pass
+        old_section_ms, old_sections = best_of(args.repeat, lambda: list(splitter.chunk_text(text)))
+        new_section_ms, sections = best_of(args.repeat, lambda: list(splitter.chunk_sentences(text, record)))
+        if old_sections != sections:
+            print(f"{name}: sections differ", file=sys.stderr)
+
+        for stage, old, new in (("clean", old_clean_ms, new_clean_ms), ("sentences", old_split_ms, new_split_ms),
+                                ("sections", old_section_ms, new_section_ms)):
+            totals[stage][0] += old
+            totals[stage][1] += new
+        documents += 1
+        characters += len(text)
+        print(
+            f"{name[:39]:<40}{len(text):>9}"
+            f"{old_clean_ms:>9.2f} ->{new_clean_ms:>6.2f}"
+            f"{old_split_ms:>9.2f} ->{new_split_ms:>6.2f}"
+            f"{old_section_ms:>9.2f} ->{new_section_ms:>6.2f}"
+        )
+
+    if not documents:
+        parser.error(f"no readable documents in {args.corpus}")
+    print(f"\n{documents} documents, {characters} cleaned characters")
+    for stage, (old, new) in totals.items():
+        print(f"{stage:<10} {old:>9.1f} ms -> {new:>8.1f} ms  ({old / new if new else float('inf'):.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,14 @@
 import chromadb
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
 import re
+import json
 import logging 
 import traceback
 import uuid
+from bisect import bisect_right
 from datetime import datetime
-import pytesseract
-from pdf2image import convert_from_path
 
 # File processing
 from PyPDF2 import PdfReader
@@ -16,18 +16,35 @@ from werkzeug.utils import secure_filename
 import docx
 
 # ML and databases
-from transformers import T5Tokenizer, T5ForConditionalGeneration
 from chromadb import PersistentClient
-
-from chromadb import Client
 from chromadb.config import Settings
 from pymongo import MongoClient
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from bson import ObjectId
 
+from inference import InferenceScheduler
+from generation_profiles import GenerationProfiles
+from model_backends import load_tokenizer, load_model, supports_encoder_cache, MODEL_NAME, INFERENCE_BACKEND
+from encoder_cache import EncoderCache
+from result_cache import ResultCache
+from ingestion import IngestionJobs
+from ocr import ocr_pages, ocr_stats, count_pdf_pages, OCR_PROCESS_WORKERS
+from embeddings import EmbeddingService, QueryEmbeddingCache
+from document_store import DocumentStore
+from chunking import SentenceChunker, CHUNK_MAX_TOKENS
+from normalization import normalize_text
+from summarization import HierarchicalSummarizer, SUMMARY_SECTION_TOKENS
+from comparison import align_chunks, excerpt, COMPARE_MAX_DOCUMENTS
+from retrieval import reciprocal_rank_fusion
+from partitions import UserPartitions
+from startup import Startup, Component
+from upload_stream import UploadRequest, UploadStream
+
 # Initialize Flask app
 app = Flask(__name__)
+# Uploaded files are written to the upload folder as the request body is read, not spooled first
+app.request_class = UploadRequest
 CORS(app, resources={
     r"/*": {
         "origins": "http://localhost:3000",  # Your frontend URL
@@ -43,6 +60,14 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024  # 25MB limit
 
+# Extraction stops once this many cleaned characters have been collected
+EXTRACTION_CHAR_BUDGET = int(os.environ.get('EXTRACTION_CHAR_BUDGET', 100000))
+# Chunks are embedded in batches of this size while extraction is still running
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 64))
+
+# Decode the advantages/limitations prompts of /generate_summary together in one batch
+BATCHED_SUMMARY_GENERATION = os.environ.get('BATCHED_SUMMARY_GENERATION', 'true').lower() == 'true'
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -55,55 +80,192 @@ logger = logging.getLogger(__name__)
 def log_request_info():
     logger.info('Request: %s %s', request.method, request.path)
 
+# Models and clients are startup components: built on first use, timed, and reported by /ready.
+# STARTUP_MODE=eager loads the models at import (once in the gunicorn master with preload_app);
+# Chroma and Mongo connections are per process and are opened in each worker after the fork.
+startup = Startup()
+
+# Each worker warms its remaining components in the background (gunicorn.conf.py does this
+# right after the fork; this covers other servers)
+@app.before_request
+def warm_components():
+    startup.warm()
+
 # Initialize ChromaDB for vector storage
-client = chromadb.Client(Settings())
-collection_name = "your_collection_name"
+# - persistent: on-disk store at CHROMA_PATH, reloaded on restart without re-embedding
+# - http: a shared Chroma server, so every gunicorn worker sees the same index
+# - memory: the old throwaway in-process store
+# persistent and memory keep the index inside one process, so with several server workers
+# (GUNICORN_WORKERS, exported by gunicorn.conf.py) each would hold its own divergent copy
+# and write the same directory; only the http mode is allowed there, and is the default.
+SERVER_WORKERS = int(os.environ.get('GUNICORN_WORKERS', 1))
+VECTOR_STORE_MODE = os.environ.get('VECTOR_STORE_MODE', 'persistent' if SERVER_WORKERS <= 1 else 'http')
+if SERVER_WORKERS > 1 and VECTOR_STORE_MODE != 'http':
+    raise RuntimeError(
+        f"VECTOR_STORE_MODE={VECTOR_STORE_MODE} is single-process but {SERVER_WORKERS} workers are configured; "
+        f"run a Chroma server with VECTOR_STORE_MODE=http or set GUNICORN_WORKERS=1"
+    )
+CHROMA_PATH = os.environ.get('CHROMA_PATH', 'chroma_data')
+CHROMA_HOST = os.environ.get('CHROMA_HOST', 'localhost')
+CHROMA_PORT = int(os.environ.get('CHROMA_PORT', 8000))
+collection_name = os.environ.get('CHROMA_COLLECTION', "your_collection_name")
+EMBEDDING_DIMENSION = 384  # all-MiniLM-L6-v2
+
+def create_vector_store_client():
+    if VECTOR_STORE_MODE == 'http':
+        return chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    if VECTOR_STORE_MODE == 'memory':
+        return chromadb.Client(Settings())
+    return PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
+
+client = startup.component("vector_store", create_vector_store_client, per_process=True)
+
+COLLECTION_METADATA = {"embedding_dimension": EMBEDDING_DIMENSION, "hnsw:space": "cosine"}
+
+# Shared collection used before vectors were partitioned per user; its chunks are
+# moved into the per-user collections when a worker opens it
+def open_shared_collection():
+    # Older versions labelled it 768-dim; the label is left alone, the migration drains it anyway
+    shared = client.get_or_create_collection(name=collection_name, metadata=COLLECTION_METADATA)
+    logger.info(f"Vector store ready ({VECTOR_STORE_MODE}): {shared.count()} chunks in '{collection_name}'")
+    try:
+        migrate_shared_collection(shared)
+    except Exception as e:
+        logger.warning(f"Vector store migration error: {str(e)}")
+    return shared
 
-# Delete the existing collection if it exists
-if collection_name in client.list_collections():
-    client.delete_collection(collection_name)
+collection = startup.component("shared_collection", open_shared_collection, per_process=True)
 
-# Create a new collection with the correct embedding dimension
-collection = client.create_collection(
-    name=collection_name,
-    metadata={"embedding_dimension": 768}  # Update to match your embedding model
-)
+# Cleaned full text of every document, so routes never rebuild it from vector store rows
+document_store = DocumentStore()
+
+# Hybrid retrieval: candidates from the vector store and BM25 are fused by reciprocal rank
+RETRIEVAL_CANDIDATES = int(os.environ.get('RETRIEVAL_CANDIDATES', 20))
+ASK_TOP_K = int(os.environ.get('ASK_TOP_K', 3))
+SEARCH_TOP_K = int(os.environ.get('SEARCH_TOP_K', 5))
+
+# One vector collection and BM25 index per user, so queries only touch that user's chunks
+partitions = UserPartitions(client, metadata=COLLECTION_METADATA)
 
 # Initialize MongoDB for history tracking
 # Updated to match the server.js MongoDB connection
-mongo_client = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'))
+# connect=False defers the connection to first use, so no socket is opened before a fork
+mongo_client = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'), connect=False)
 db = mongo_client['thinkbriefDB']  # Changed from 'researchai' to 'thinkbriefDB'
 user_history_collection = db['userhistories']  # Changed to match the mongoose model collection name
+result_cache_collection = db['resultcaches']  # Persistent tier of the generation result cache
+
+# Check the connection and create the collections' indexes (both idempotent, so every worker runs it)
+def open_mongo():
+    status = mongo_client.admin.command('ping')
+    result_cache.ensure_indexes()
+    ingestion_jobs.ensure_indexes()
+    return status
+
+mongo = startup.component("mongo", open_mongo, per_process=True)
+
+# Move chunks of the shared collection into their owners' partitions (idempotent, so
+# concurrent workers starting together are harmless)
+def migrate_shared_collection(shared):
+    if shared.count() == 0:
+        return
+    moved = 0
+    for entry in user_history_collection.find({}, {"userId": 1, "documentId": 1}):
+        doc_id = entry.get("documentId")
+        chunks = shared.get(where={"doc_id": doc_id}, include=["embeddings", "documents", "metadatas"])
+        if not chunks['ids']:
+            continue
+        partitions.collection(entry["userId"]).upsert(
+            ids=chunks['ids'],
+            embeddings=chunks['embeddings'],
+            documents=chunks['documents'],
+            metadatas=chunks['metadatas']
+        )
+        shared.delete(ids=chunks['ids'])
+        moved += len(chunks['ids'])
+    logger.info(f"Moved {moved} chunks from '{collection_name}' into per-user collections")
+
+# Background ingestion for /upload and /batch_upload, with job status mirrored to Mongo
+ingestion_jobs = IngestionJobs(db['ingestionjobs'])
 
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'pdf', 'docx', 'txt'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Load FLAN-T5 model with device mapping for potential GPU acceleration
-def load_model():
+# Load FLAN-T5 with the configured backend (INFERENCE_BACKEND = pytorch | int8 | onnx)
+def load_flan_t5():
     try:
-        logger.info("Loading FLAN-T5 model...")
-        tokenizer = T5Tokenizer.from_pretrained("google/flan-t5-base")
-        model = T5ForConditionalGeneration.from_pretrained("google/flan-t5-base", device_map="auto")
+        logger.info(f"Loading FLAN-T5 model ({INFERENCE_BACKEND})...")
+        model = load_model(MODEL_NAME, INFERENCE_BACKEND)
         logger.info("Model loaded successfully")
-        return tokenizer, model
+        return model
     except Exception as e:
         logger.error(f"Model loading failed: {str(e)}")
         raise
 
-tokenizer, model = load_model()
+tokenizer = startup.component("flan_t5_tokenizer", lambda: load_tokenizer(MODEL_NAME))
+model = startup.component("flan_t5", load_flan_t5)
+
+# Quantized and ONNX outputs drift slightly from fp32, so they get their own cache entries
+model_id = MODEL_NAME if INFERENCE_BACKEND == 'pytorch' else f"{MODEL_NAME}+{INFERENCE_BACKEND}"
+
+# Cache of encoder hidden states so repeat decodes on a document skip the encoder
+encoder_cache = EncoderCache(namespace=model_id) if supports_encoder_cache(INFERENCE_BACKEND) else None
+
+# Cache of finished summaries/answers keyed by input content and generation settings
+result_cache = ResultCache(result_cache_collection, model_id=model_id)
+
+# Named decoding settings ("fast", "balanced", "quality") with per-profile time budgets
+generation_profiles = GenerationProfiles()
+
+# Central scheduler that batches generate calls from all routes
+scheduler = InferenceScheduler(tokenizer, model, encoder_cache=encoder_cache, result_cache=result_cache)
 
 # Initialize embedding model
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+def load_embedding_model():
+    loaded = SentenceTransformer("all-MiniLM-L6-v2")
+    if loaded.get_sentence_embedding_dimension() != EMBEDDING_DIMENSION:
+        logger.warning("Embedding model dimension does not match the vector store collection")
+    return loaded
+
+embedding_model = startup.component("minilm", load_embedding_model)
+
+# Report embedding throughput and query latency as they happen
+def log_embedding_metrics(event, data):
+    logger.debug(f"Embedding {event}: {data}")
+
+# Batched chunk embedding and coalesced, cached query embedding for /ask and /search
+embedding_service = EmbeddingService(
+    embedding_model,
+    metrics_hook=log_embedding_metrics,
+    query_cache=QueryEmbeddingCache()
+)
+
+# Sentence-packing chunker; chunks fit the embedding window (less [CLS]/[SEP]) so nothing is truncated
+chunker = Component("chunker", lambda: SentenceChunker(
+    embedding_model.tokenizer,
+    max_tokens=CHUNK_MAX_TOKENS or embedding_model.max_seq_length - 2
+))
+
+# Map-reduce summaries over full documents, with encoder-window-sized sections
+summarizer = HierarchicalSummarizer(
+    scheduler,
+    Component("section_splitter", lambda: SentenceChunker(
+        embedding_model.tokenizer, max_tokens=SUMMARY_SECTION_TOKENS, overlap_tokens=0
+    ))
+)
+
+if startup.mode == 'eager':
+    startup.load(shared_only=True)
+# Token budgets for the reduced content placed into the final summary prompt, and for all
+# document digests together in a comparison prompt
+SUMMARY_DIGEST_TOKENS = int(os.environ.get('SUMMARY_DIGEST_TOKENS', 800))
+COMPARE_DIGEST_TOKENS = int(os.environ.get('COMPARE_DIGEST_TOKENS', 480))
 
 # Helper function for text cleaning
 def clean_text(text):
-    # Remove URLs
-    text = re.sub(r'http\S+|www\S+|https\S+', '', text, flags=re.MULTILINE)
-    # Normalize whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-    # Limit text length to prevent issues with large documents
-    return text[:100000]  # Limit to 100K characters
+    # Remove URLs and normalize whitespace in one pass, limited to 100K characters
+    return normalize_text(text, limit=100000)
 
 # Enhanced text cleaning with better formatting
 def clean_and_improve_text(text, target_length=250):
@@ -134,104 +296,95 @@ def clean_and_improve_text(text, target_length=250):
             
     return result
 
-# OCR function for when regular PDF extraction fails
-def ocr_pdf(file_path):
-    logger.info("Attempting OCR for PDF...")
-    try:
-        images = convert_from_path(
-            file_path,
-            dpi=300,
-            grayscale=True,
-            thread_count=4
-        )
-        
-        ocr_text = []
-        for img in images:
-            try:
-                custom_config = r'--oem 3 --psm 1'
-                page_text = pytesseract.image_to_string(img, config=custom_config)
-                if page_text.strip():
-                    ocr_text.append(page_text)
-            except Exception as ocr_error:
-                logger.warning(f"OCR error: {str(ocr_error)}")
-                continue
-                
-        if ocr_text:
-            return clean_text("\n".join(ocr_text))
-        return None
-    except Exception as e:
-        logger.error(f"OCR process failed: {str(e)}")
-        return None
+# PDF pages are read ahead in windows of this size so their OCR can run in parallel
+OCR_WINDOW_PAGES = max(1, OCR_PROCESS_WORKERS * 2)
 
-# PDF text extraction with OCR fallback
-def extract_text_from_pdf(file_path):
-    try:
-        text = ""
-        # First attempt: PyPDF2 with strict mode disabled
-        with open(file_path, 'rb') as file:
-            try:
-                reader = PdfReader(file, strict=False)
-                for page in reader.pages:
-                    try:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n"
-                    except Exception as page_error:
-                        logger.warning(f"Page extraction error: {str(page_error)}")
-                        continue
-            except Exception as pdf_error:
-                logger.error(f"PyPDF2 error: {str(pdf_error)}")
-                
-        # If regular extraction worked, return the text
-        if text.strip():
-            return clean_text(text)
-            
-        # Second attempt: OCR fallback
-        return ocr_pdf(file_path)
-            
-    except Exception as e:
-        logger.error(f"Complete PDF extraction failure: {str(e)}")
-        logger.error(traceback.format_exc())
-        return None
+# Progress callback used when no ingestion job is tracking the work
+def no_progress(stage, current=None, total=None):
+    pass
 
-# DOCX text extraction
-def extract_text_from_docx(file_path):
-    try:
-        doc = docx.Document(file_path)
-        return clean_text("\n".join(para.text for para in doc.paragraphs if para.text.strip()))
-    except Exception as e:
-        logger.error(f"DOCX extraction error: {str(e)}")
-        return None
-
-# TXT file extraction
-def extract_text_from_txt(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return clean_text(file.read(500000).strip())
-    except Exception as e:
-        logger.error(f"TXT extraction error: {str(e)}")
-        return None
+# PDF page extraction with per-page OCR fallback, yields (page_number, text) in order
+def iter_pdf_pages(file_path, progress=no_progress):
+    with open(file_path, 'rb') as file:
+        # First attempt: PyPDF2 with strict mode disabled
+        try:
+            reader = PdfReader(file, strict=False)
+            total_pages = len(reader.pages)
+        except Exception as pdf_error:
+            logger.error(f"PyPDF2 error: {str(pdf_error)}")
+            # PyPDF2 could not read the file at all: every page goes through OCR
+            reader = None
+            total_pages = count_pdf_pages(file_path)
+
+        # Pages are read in small windows so OCR of empty pages can run in parallel
+        window = []
+        for page_number in range(1, total_pages + 1):
+            page_text = ""
+            if reader is not None:
+                try:
+                    page_text = reader.pages[page_number - 1].extract_text() or ""
+                except Exception as page_error:
+                    logger.warning(f"Page extraction error: {str(page_error)}")
+            window.append([page_number, page_text])
+
+            if len(window) < OCR_WINDOW_PAGES and page_number < total_pages:
+                continue
 
-# Extract text based on file type
-def extract_text(file_path, file_extension):
-    if file_extension.lower() == '.pdf':
-        return extract_text_from_pdf(file_path)
-    elif file_extension.lower() == '.docx':
-        return extract_text_from_docx(file_path)
-    elif file_extension.lower() == '.txt':
-        return extract_text_from_txt(file_path)
-    else:
+            # Second attempt: OCR only the pages that yielded no text
+            empty_pages = [n for n, text in window if not text.strip()]
+            if empty_pages:
+                try:
+                    ocr_texts = ocr_pages(
+                        file_path,
+                        empty_pages,
+                        progress=lambda stage, done, _: progress(stage, empty_pages[done - 1], total_pages)
+                    )
+                    for entry in window:
+                        entry[1] = ocr_texts.get(entry[0], entry[1])
+                except Exception as ocr_error:
+                    logger.error(f"OCR process failed: {str(ocr_error)}")
+
+            for page_number_in_window, text in window:
+                yield page_number_in_window, text
+            window = []
+
+# DOCX extraction - documents have no page structure, so yield a single page
+def iter_docx_pages(file_path, progress=no_progress):
+    doc = docx.Document(file_path)
+    yield 1, "\n".join(para.text for para in doc.paragraphs if para.text.strip())
+
+# TXT extraction
+def iter_txt_pages(file_path, progress=no_progress):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        yield 1, file.read(500000).strip()
+
+# Iterate the raw pages of a document based on file type
+def iter_document_pages(file_path, file_extension, progress=no_progress):
+    extractors = {'.pdf': iter_pdf_pages, '.docx': iter_docx_pages, '.txt': iter_txt_pages}
+    extractor = extractors.get(file_extension.lower())
+    if extractor is None:
         logger.error(f"Unsupported file type: {file_extension}")
-        return None
+        return
+    progress("extract")
+    yield from extractor(file_path, progress=progress)
 
-# Helper function to chunk text
-def chunk_text(text, chunk_size=512, overlap=50):
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = " ".join(words[i:i + chunk_size])
-        chunks.append(chunk)
-    return chunks
+# Clean pages and stop extracting once the character budget is used up
+def budget_pages(pages, char_budget=EXTRACTION_CHAR_BUDGET):
+    used = 0
+    try:
+        for page_number, page_text in pages:
+            page_text = clean_text(page_text)
+            if not page_text:
+                continue
+            remaining = char_budget - used
+            if len(page_text) >= remaining:
+                yield page_number, page_text[:remaining]
+                return
+            used += len(page_text) + 1  # pages are joined with a single space
+            yield page_number, page_text
+    finally:
+        # Stops any remaining PyPDF2/OCR work as soon as the budget is reached
+        pages.close()
 
 # Add this new helper function at the top level with other helper functions
 def post_process_summary(text):
@@ -254,6 +407,111 @@ def post_process_summary(text):
         processed_text += '.'
     return processed_text
 
+# Load a document's cleaned text (optionally only the first `limit` characters) and its filename
+def load_document_text(doc_id, user_id, limit=None):
+    text, metadata = document_store.get_with_metadata(doc_id, 0, limit)
+    if text is not None:
+        return text, metadata.get('source', 'unknown')
+
+    # Documents indexed before the document store existed: rebuild from ChromaDB chunks
+    results = partitions.collection(user_id).get(where={"doc_id": doc_id}, include=["documents", "metadatas"])
+    if not results['documents']:
+        return None, None
+    ordered = sorted(zip(results['metadatas'], results['documents']), key=lambda item: item[0].get('chunk_id', 0))
+    text = " ".join(chunk for _, chunk in ordered)
+    return text[:limit] if limit else text, ordered[0][0].get('source', 'unknown')
+
+# Sentence spans and token counts recorded at ingestion, None for documents stored before them
+def document_sentences(doc_id):
+    return (document_store.metadata(doc_id) or {}).get("sentences")
+
+# Fused vector + BM25 retrieval over one user's partition, optionally limited to one
+# document; returns the top_k chunks best first
+def retrieve_chunks(query, query_embedding, user_id, top_k, doc_id=None):
+    user_collection = partitions.collection(user_id)
+    if user_collection.count() == 0:
+        return []
+    vector_results = user_collection.query(
+        query_embeddings=[query_embedding.tolist()],
+        n_results=RETRIEVAL_CANDIDATES,
+        where={"doc_id": doc_id} if doc_id else None
+    )
+    chunks = {}
+    for chunk_id, document, metadata, distance in zip(
+        vector_results['ids'][0],
+        vector_results['documents'][0],
+        vector_results['metadatas'][0],
+        vector_results['distances'][0]
+    ):
+        chunks[chunk_id] = {"document": document, "metadata": metadata, "distance": distance}
+
+    keyword_index = partitions.keyword_index(user_id, sync=doc_id is None)
+    keyword_results = keyword_index.search(
+        query,
+        doc_ids=[doc_id] if doc_id else None,
+        limit=RETRIEVAL_CANDIDATES
+    )
+    fused = reciprocal_rank_fusion([
+        vector_results['ids'][0],
+        [chunk_id for chunk_id, _ in keyword_results]
+    ])[:top_k]
+
+    # Keyword-only hits still need their text and metadata
+    missing = [chunk_id for chunk_id, _ in fused if chunk_id not in chunks]
+    if missing:
+        extra = user_collection.get(ids=missing, include=["documents", "metadatas"])
+        for chunk_id, document, metadata in zip(extra['ids'], extra['documents'], extra['metadatas']):
+            chunks[chunk_id] = {"document": document, "metadata": metadata, "distance": None}
+
+    return [
+        dict(chunks[chunk_id], id=chunk_id, score=score)
+        for chunk_id, score in fused
+        if chunk_id in chunks  # chunks deleted by another worker since they were indexed
+    ]
+
+# Profile named in the request ({"profile": ...} or ?profile=...), falling back to GENERATION_PROFILE
+def requested_profile():
+    data = request.get_json(silent=True) or {}
+    return generation_profiles.resolve(data.get('profile') or request.args.get('profile'))
+
+# Decoding settings for a task under the requested profile
+def generation_settings(task):
+    return generation_profiles.settings(task, requested_profile(), sample=sampling_requested())
+
+# Streaming is requested with {"stream": true}, ?stream=true or an Accept: text/event-stream header
+def stream_requested():
+    data = request.get_json(silent=True) or {}
+    return (
+        data.get('stream') is True
+        or request.args.get('stream', '').lower() == 'true'
+        or request.accept_mimetypes.best == 'text/event-stream'
+    )
+
+# Send (event, payload) pairs as server-sent events; errors after the headers are sent become an error event
+def sse_response(events):
+    def encode():
+        try:
+            for event, payload in events:
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            logger.error(f"Streaming error: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            # The server closes the response when the client disconnects; pass that on
+            events.close()
+
+    return Response(
+        stream_with_context(encode()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Cached results are bypassed when the client explicitly asks for non-deterministic sampling
+def sampling_requested():
+    data = request.get_json(silent=True) or {}
+    return data.get('do_sample') is True
+
 # Helper to get user ID from request
 def get_user_id():
     # In a real implementation, this would extract a valid user ID from auth token
@@ -265,108 +523,282 @@ def get_user_id():
         return "64f3e2c15f7c48c39e32a9b0"  # Example ObjectId
     return user_id
 
-# Process uploaded document - core functionality used by multiple routes
-def process_uploaded_document(file):
-    try:
-        if file.filename == '':
-            return {"error": "Empty filename"}, 400
+# Validate and save an uploaded file - this part needs the request context
+def save_uploaded_file(file):
+    if file.filename == '':
+        return None, ({"error": "Empty filename"}, 400)
 
-        # Check file size
-        file.seek(0, 2)
-        file_size = file.tell()
-        file.seek(0)
+    # Multipart uploads were already streamed to disk, hashed and type-checked by
+    # UploadRequest while the body was read; anything else is copied through the same checks
+    upload = file.stream
+    if not isinstance(upload, UploadStream):
+        upload = UploadStream.copy_of(app.config['UPLOAD_FOLDER'], file.filename, file.stream)
 
-        if file_size > app.config['MAX_CONTENT_LENGTH']:
-            return {"error": "File too large (max 10MB)"}, 400
+    content_hash = upload.finish()
+    if content_hash is None:
+        return None, ({"error": upload.error}, 400)
 
-        # Get file extension
-        filename = secure_filename(file.filename)
-        file_extension = os.path.splitext(filename)[1].lower()
-        
-        # Check supported file types
-        if file_extension not in ['.pdf', '.docx', '.txt']:
-            return {"error": "Unsupported file type. Please upload PDF, DOCX, or TXT files."}, 400
+    # Store under the content hash, so identical uploads share one file and different
+    # files with the same name no longer overwrite each other
+    filename = secure_filename(file.filename)
+    file_extension = upload.extension
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{content_hash}{file_extension}")
+    upload.save(file_path)
 
-        # Save file
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+    return {
+        "file_path": file_path,
+        "filename": filename,
+        "file_extension": file_extension,
+        "content_hash": content_hash
+    }, None
+
+# Write the userhistories entry of a finished upload and build the upload response
+def record_upload(upload, user_id, doc_id, text_preview, **fields):
+    user_history_collection.insert_one({
+        "userId": ObjectId(user_id),
+        "documentId": doc_id,  # Use consistent documentId field
+        "documentTitle": upload["filename"],
+        "contentHash": upload["content_hash"],
+        "storedFile": os.path.basename(upload["file_path"]),
+        "timestamp": datetime.utcnow(),
+        "text_preview": text_preview,
+        "queries": [],  # Initialize empty queries array
+        **fields
+    })
+    return {
+        "message": "File uploaded and processed successfully",
+        "documentId": doc_id,  # Always included
+        "documentTitle": upload["filename"],
+        "text_preview": text_preview
+    }, 200
+
+# Reuse the text, chunks and embeddings of an earlier upload with the same content, so a
+# duplicate only gets its own copies under a new documentId; returns None when no complete
+# copy exists and the file has to be ingested normally
+def ingest_duplicate(upload, user_id, doc_id):
+    source = user_history_collection.find_one(
+        {"contentHash": upload["content_hash"]},
+        {"userId": 1, "documentId": 1, "sectionSummaries": 1},
+        sort=[("timestamp", -1)]
+    )
+    if not source:
+        return None
 
-        # Extract text
-        text = extract_text(file_path, file_extension)
-        if not text:
+    source_id = source["documentId"]
+    chunks = partitions.collection(str(source["userId"])).get(
+        where={"doc_id": source_id},
+        include=["embeddings", "documents", "metadatas"]
+    )
+    filename = upload["filename"]
+    if not chunks['ids'] or not document_store.copy(source_id, doc_id, {"source": filename}):
+        return None
+
+    # Chunk ids are "<documentId>_<n>"
+    ids = [f"{doc_id}{chunk_id[len(source_id):]}" for chunk_id in chunks['ids']]
+    partitions.collection(user_id).add(
+        ids=ids,
+        documents=chunks['documents'],
+        embeddings=chunks['embeddings'],
+        metadatas=[{**metadata, "doc_id": doc_id, "source": filename} for metadata in chunks['metadatas']]
+    )
+    partitions.keyword_index(user_id).add(doc_id, ids, chunks['documents'])
+
+    text = document_store.get(doc_id, 0, 201) or ""
+    logger.info(f"Upload {filename} matches document {source_id}, reused its {len(ids)} chunks")
+    return record_upload(
+        upload, user_id, doc_id,
+        text[:200] + "..." if len(text) > 200 else text,
+        # Section summaries depend only on the content, so /compare can reuse them too
+        **({"sectionSummaries": source["sectionSummaries"]} if source.get("sectionSummaries") else {})
+    )
+
+# Extract, chunk, embed and index a saved file - safe to run in a background worker
+def ingest_document(upload, user_id, doc_id, progress=no_progress):
+    try:
+        duplicate = ingest_duplicate(upload, user_id, doc_id)
+        if duplicate:
+            return duplicate
+
+        filename = upload["filename"]
+
+        # Stream pages straight into chunking and embedding
+        pages = budget_pages(iter_document_pages(upload["file_path"], upload["file_extension"], progress))
+        page_texts, page_offsets, page_starts = [], [], []
+
+        def keep_page_text(pages):
+            offset = 0
+            for page_number, page_text in pages:
+                page_texts.append(page_text)
+                page_offsets.append([page_number, offset])
+                page_starts.append(offset)
+                offset += len(page_text) + 1
+                yield page_number, page_text
+
+        def page_at(char_offset):
+            return page_offsets[bisect_right(page_starts, char_offset) - 1][0]
+
+        chunks, metadatas, embeddings = [], [], []
+        pending = []
+        # Sentence spans and token counts, kept so summaries can re-section without tokenizing
+        sentences = []
+
+        def embed_pending():
+            progress("embed", len(chunks) + len(pending))
+            embeddings.extend(embedding_service.encode_documents(pending).tolist())
+            chunks.extend(pending)
+            pending.clear()
+
+        for chunk, char_start, char_end in chunker.chunk_pages(keep_page_text(pages), sentences=sentences):
+            metadatas.append({
+                "doc_id": doc_id,  # Keep this as doc_id for ChromaDB queries
+                "chunk_id": len(metadatas),
+                "source": filename,
+                "page_start": page_at(char_start),
+                "page_end": page_at(char_end - 1),
+                "char_start": char_start,
+                "char_end": char_end
+            })
+            pending.append(chunk)
+            if len(pending) >= EMBEDDING_BATCH_SIZE:
+                embed_pending()
+        if pending:
+            embed_pending()
+
+        if not chunks:
             return {"error": "Failed to extract text from document"}, 500
+        text = " ".join(page_texts)
 
-        # Split text into chunks
-        chunks = chunk_text(text, chunk_size=512, overlap=50)
-        
-        # Generate embeddings
-        embeddings = embedding_model.encode(chunks)
+        # Keep the cleaned text for summaries, comparisons and document details
+        document_store.put(doc_id, text, {"source": filename, "pages": page_offsets, "sentences": sentences})
 
-        # Add embeddings to the ChromaDB collection
-        doc_id = str(uuid.uuid4())
-        collection.add(
+        # Add embeddings to the user's ChromaDB collection
+        progress("index")
+        partitions.collection(user_id).add(
             ids=[f"{doc_id}_{i}" for i in range(len(chunks))],
             documents=chunks,
-            embeddings=embeddings.tolist(),
-            metadatas=[{
-                "doc_id": doc_id,  # Keep this as doc_id for ChromaDB queries
-                "chunk_id": i,
-                "source": filename
-            } for i in range(len(chunks))]
+            embeddings=embeddings,
+            metadatas=metadatas
         )
+        partitions.keyword_index(user_id).add(doc_id, [f"{doc_id}_{i}" for i in range(len(chunks))], chunks)
+
+        # Save to MongoDB history with consistent field naming
+        return record_upload(upload, user_id, doc_id, text[:200] + "..." if len(text) > 200 else text)
+
+    except Exception as e:
+        logger.error(f"Ingestion error: {str(e)}")
+        logger.error(traceback.format_exc())
+        return {"error": str(e)}, 500
+
+# Process uploaded document inline - used by routes that need the result immediately
+def process_uploaded_document(file):
+    try:
+        upload, error = save_uploaded_file(file)
+        if error:
+            return error
+        return ingest_document(upload, get_user_id(), str(uuid.uuid4()))
+
+    except Exception as e:
+        logger.error(f"Upload error: {str(e)}")
+        logger.error(traceback.format_exc())
+        return {"error": str(e)}, 500
 
-        # Get user ID for history
+# Save the upload and queue its ingestion - returns a job description immediately
+def queue_uploaded_document(file):
+    try:
+        upload, error = save_uploaded_file(file)
+        if error:
+            return error
+
+        doc_id = str(uuid.uuid4())
         user_id = get_user_id()
 
-        # Save to MongoDB history with consistent field naming
-        user_history_collection.insert_one({
-            "userId": ObjectId(user_id),
-            "documentId": doc_id,  # Use consistent documentId field
-            "documentTitle": filename,
-            "timestamp": datetime.utcnow(),
-            "text_preview": text[:200] + "..." if len(text) > 200 else text,
-            "queries": []  # Initialize empty queries array
-        })
+        # Content seen before: no extraction or embedding needed, so answer right away
+        duplicate = ingest_duplicate(upload, user_id, doc_id)
+        if duplicate:
+            return duplicate
 
-        # After processing the upload
+        job_id = ingestion_jobs.submit(
+            ingest_document, upload, user_id, doc_id,
+            filename=upload["filename"],
+            user_id=user_id,
+            content_hash=upload["content_hash"]
+        )
         return {
-            "message": "File uploaded and processed successfully",
-            "documentId": doc_id,  # Always included
-            "documentTitle": filename,
-            "text_preview": text[:200] + "..." if len(text) > 200 else text
-        }, 200
+            "message": "File uploaded, processing started",
+            "jobId": job_id,
+            "documentId": doc_id,
+            "documentTitle": upload["filename"],
+            "status": "queued",
+            "statusUrl": f"/jobs/{job_id}"
+        }, 202
 
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
         logger.error(traceback.format_exc())
         return {"error": str(e)}, 500
 
+# Clients can pass ?wait=true to get the old synchronous upload behaviour
+def wait_requested():
+    return request.args.get('wait', request.form.get('wait', 'false')).lower() == 'true'
+
 @app.route('/')
 def health_check():
     return jsonify({
         "status": "active",
         "model": "FLAN-T5-base",
         "endpoints": {
-            "/upload": {"method": "POST", "description": "Upload a document (PDF, DOCX, TXT)"},
+            "/upload": {"method": "POST", "description": "Upload a document (PDF, DOCX, TXT); returns a job id"},
+            "/jobs/<job_id>": {"method": "GET", "description": "Get the status of an upload job"},
             "/summarize": {"method": "POST", "description": "Legacy endpoint - Upload a document"},
             "/summarize_text": {"method": "POST", "description": "Legacy endpoint - Upload a document"},
             "/generate_summary": {"method": "POST", "description": "Generate summary for uploaded document"},
             "/ask": {"method": "POST", "description": "Ask questions about a document"},
             "/history": {"method": "GET", "description": "Get document history"},
             "/document/<doc_id>": {"method": "GET", "description": "Get details of a specific document"},
-            "/delete/<doc_id>": {"method": "DELETE", "description": "Delete a document"}
+            "/delete/<doc_id>": {"method": "DELETE", "description": "Delete a document"},
+            "/metrics": {"method": "GET", "description": "Inference and cache metrics"},
+            "/ready": {"method": "GET", "description": "Readiness of models and stores, with startup timings"}
         }
     })
 
+# Readiness, unlike the health check above: 503 until this worker has loaded every component
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    status = startup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify({
+        "inference": scheduler.metrics(),
+        "encoder_cache": encoder_cache.stats() if encoder_cache is not None else None,
+        "partitions": partitions.stats(),
+        "result_cache": result_cache.stats(),
+        "generation_profiles": {"default": generation_profiles.default, "available": generation_profiles.names()},
+        "embeddings": embedding_service.metrics(),
+        "ocr": ocr_stats(),
+        "startup": startup.status()
+    })
+
 @app.route('/upload', methods=['POST'])
 def upload_document():
     if 'file' not in request.files:
         return jsonify({"error": "No file provided"}), 400
         
     file = request.files['file']
-    result, status_code = process_uploaded_document(file)
+    if wait_requested():
+        result, status_code = process_uploaded_document(file)
+    else:
+        result, status_code = queue_uploaded_document(file)
     return jsonify(result), status_code
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = ingestion_jobs.get(job_id)
+    if not job or job.get("userId") != get_user_id():
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
 @app.route('/summarize', methods=['POST'])
 def summarize():
     """Legacy endpoint that redirects to upload_document"""
@@ -382,36 +814,18 @@ def summarize():
         result["doc_id"] = result["documentId"]
         # Trigger immediate summary generation
         try:
-            # Get the uploaded text
-            results = collection.get(where={"doc_id": doc_id}, include=["documents"])
-            if results['documents'] and len(results['documents']) > 0:  # Fixed check for array length
-                # Join all document chunks to get complete context
-                context = " ".join(results['documents'])  # Fix: Join all document chunks
-                context = context[:5000]  # Limit to 5000 chars for processing
-                
+            # Get the uploaded text, limited to 5000 chars for processing
+            context, _ = load_document_text(doc_id, get_user_id(), limit=5000)
+            if context:
                 # Generate a quick summary
-                inputs = tokenizer(
+                summary = scheduler.generate(
                     f"Summarize this:\n{context}",
-                    return_tensors="pt",
-                    max_length=1024,
-                    truncation=True
+                    max_input_length=1024,
+                    cache_key=(doc_id, "Summarize this:\n", 5000),
+                    cache_result=True,
+                    **generation_settings("summary")
                 )
                 
-                summary_ids = model.generate(
-                    inputs.input_ids,
-                    max_length=800,  # Longer output
-                    min_length=600,  # Ensure minimum length
-                    num_beams=5,     # More beams for better search
-                    length_penalty=2.0,  # Encourage longer outputs
-                    temperature=0.7,  # Better creativity balance
-                    top_p=0.9,       # Nucleus sampling
-                    do_sample=True,  # Enable sampling
-                    no_repeat_ngram_size=3,  # Avoid repetition
-                    repetition_penalty=1.2   # Penalize repeats
-                )
-                
-                summary = tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-                
                 # Add summary to result
                 result["summary"] = summary
                 result["context_used"] = len(context)
@@ -436,30 +850,14 @@ def summarize_text():
         # Add a clear instruction to the input
         prompt = f"Provide a concise, non-repetitive summary of the following text:\n\n{text}"
         
-        inputs = tokenizer(
+        summary = scheduler.generate(
             prompt,
-            return_tensors="pt",
-            max_length=1024,
-            truncation=True
-        )
-        
-        summary_ids = model.generate(
-            inputs.input_ids,
-            max_length=400,
-            min_length=200,  # Set minimum length
-            num_beams=5,     # Increase beam search
-            length_penalty=1.5,
-            temperature=0.7,
-            no_repeat_ngram_size=3,
-            repetition_penalty=2.5,  # Increase repetition penalty
-            early_stopping=True,
-            do_sample=True,   # Enable sampling
-            top_p=0.92,       # Use nucleus sampling
-            top_k=50          # Limit vocabulary diversity
+            max_input_length=1024,
+            cache_result=not sampling_requested(),
+            **generation_settings("text_summary")
         )
         
-        # Decode and post-process the summary
-        summary = tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+        # Post-process the summary
         summary = post_process_summary(summary)
         
         # Return documentId explicitly if provided in the request
@@ -484,21 +882,11 @@ def generate_summary():
         if not doc_id:
             return jsonify({"error": "Missing document ID"}), 400
 
-        # Retrieve document from ChromaDB
-        results = collection.get(where={"doc_id": doc_id}, include=["documents", "metadatas"])
-        if not results['documents'] or len(results['documents']) == 0:
+        # Retrieve the full cleaned text; long documents are summarized section by section
+        text, filename = load_document_text(doc_id, get_user_id())
+        if not text:
             return jsonify({"error": "Document not found"}), 404
 
-        # Combine all document chunks into a single text
-        text = " ".join([item for sublist in results['documents'] for item in sublist])
-        
-        # Get metadata from the first chunk
-        if results['metadatas'] and len(results['metadatas']) > 0 and len(results['metadatas'][0]) > 0:
-            metadata = results['metadatas'][0][0]  # Get the first metadata entry
-            filename = metadata.get('source', 'unknown')
-        else:
-            filename = "unknown"
-
         # Generate summary with improved prompt
         summary_prompt = (
             "Provide a detailed academic analysis of the following document in 300-400 words. "
@@ -510,29 +898,30 @@ def generate_summary():
             "Make the summary comprehensive yet clear and well-structured:\n\n"
         )
 
-        inputs = tokenizer(
-            summary_prompt + text[:8000],  # Increased context length
-            return_tensors="pt",
-            max_length=1024,
-            truncation=True
-        )
-
-        summary_ids = model.generate(
-            inputs.input_ids,
-            max_length=800,  # Longer output
-            min_length=600,  # Ensure minimum length
-            num_beams=5,     # More beams for better search
-            length_penalty=2.0,  # Encourage longer outputs
-            temperature=0.7,  # Better creativity balance
-            top_p=0.9,       # Nucleus sampling
-            do_sample=True,  # Enable sampling
-            no_repeat_ngram_size=3,  # Avoid repetition
-            repetition_penalty=1.2   # Penalize repeats
-        )
-        
-        summary = tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-
-        # Generate advantages with improved prompt and parsing
+        summary_generation = generation_settings("summary")
+        section_generation = generation_settings("section")
+        reduce_generation = generation_settings("reduce")
+        streaming = stream_requested()
+        sections = summarizer.sections(text, document_sentences(doc_id))
+        # The profile's max_time bounds the whole request: every call below gets what is left
+        deadline = generation_profiles.deadline(requested_profile())
+
+        def summary_input():
+            # Returns (prompt, encoder cache key). Short documents fit the encoder as they are;
+            # longer ones are first reduced to a digest of per-section summaries (map-reduce)
+            if len(sections) <= 1:
+                return summary_prompt + text[:8000], (doc_id, summary_prompt, 8000)
+            digest = summarizer.digest(
+                sections,
+                SUMMARY_DIGEST_TOKENS,
+                section_generation,
+                reduce_generation,
+                cache_result=not sampling_requested(),
+                deadline=deadline
+            )
+            return SUMMARY_TEMPLATE.format(content=digest), None
+
+        # Generate advantages and limitations with improved prompts and parsing
         adv_prompt = (
             "Extract exactly 3 key advantages or strengths from this document. "
             "Format as a numbered list with each item on a new line like this:\n"
@@ -540,35 +929,6 @@ def generate_summary():
             "2. Second advantage\n"
             "3. Third advantage\n\n"
         )
-        
-        adv_inputs = tokenizer(
-            adv_prompt + text[:3000],
-            return_tensors="pt",
-            max_length=1024,
-            truncation=True
-        )
-        
-        adv_ids = model.generate(
-            adv_inputs.input_ids, 
-            max_length=200, 
-            num_beams=4, 
-            no_repeat_ngram_size=2
-        )
-        
-        advantages_text = tokenizer.decode(adv_ids[0], skip_special_tokens=True)
-        
-        # Improved parsing with regex to extract numbered items
-        advantages = []
-        adv_matches = re.findall(r'(?:\d+\.|\-|\|\•)\s([^\n\d\-\*\•]+)', advantages_text)
-        for match in adv_matches:
-            if match.strip():
-                advantages.append(match.strip())
-        
-        # If regex failed to extract advantages, use the whole text
-        if not advantages and advantages_text.strip():
-            advantages = [advantages_text.strip()]
-        
-        # Generate disadvantages with similar improved prompt and parsing
         disadv_prompt = (
             "Extract exactly 3 limitations or weaknesses from this document. "
             "Format as a numbered list with each item on a new line like this:\n"
@@ -576,56 +936,118 @@ def generate_summary():
             "2. Second limitation\n"
             "3. Third limitation\n\n"
         )
-        
-        disadv_inputs = tokenizer(
-            disadv_prompt + text[:3000],
-            return_tensors="pt",
-            max_length=1024,
-            truncation=True
-        )
-        
-        disadv_ids = model.generate(
-            disadv_inputs.input_ids, 
-            max_length=200, 
-            num_beams=4, 
-            no_repeat_ngram_size=2
-        )
-        
-        disadvantages_text = tokenizer.decode(disadv_ids[0], skip_special_tokens=True)
-        
-        # Use the same regex pattern for disadvantages
-        disadvantages = []
-        disadv_matches = re.findall(r'(?:\d+\.|\-|\|\•)\s([^\n\d\-\*\•]+)', disadvantages_text)
-        for match in disadv_matches:
-            if match.strip():
-                disadvantages.append(match.strip())
-        
-        # If regex failed to extract disadvantages, use the whole text
-        if not disadvantages and disadvantages_text.strip():
-            disadvantages = [disadvantages_text.strip()]
+        list_generation = generation_settings("list")
+
+        if data.get('batched', BATCHED_SUMMARY_GENERATION):
+            # Tokenize the shared text[:3000] once and decode both lists in a single batch
+            list_futures = scheduler.submit_shared(
+                [adv_prompt, disadv_prompt],
+                text[:3000],
+                max_input_length=1024,
+                cache_keys=[(doc_id, adv_prompt, 3000), (doc_id, disadv_prompt, 3000)],
+                cache_result=not sampling_requested(),
+                **deadline.apply(list_generation)
+            )
+
+            def list_texts():
+                return [future.result() for future in list_futures]
+        else:
+            def list_texts():
+                return [
+                    scheduler.generate(
+                        prompt + text[:3000],
+                        max_input_length=1024,
+                        cache_key=(doc_id, prompt, 3000),
+                        cache_result=not sampling_requested(),
+                        **deadline.apply(list_generation)
+                    )
+                    for prompt in (adv_prompt, disadv_prompt)
+                ]
+
+        # Queue the final summary once its input is ready; the list prompts above decode meanwhile
+        if not streaming:
+            prompt, cache_key = summary_input()
+            summary_future = scheduler.submit(
+                prompt,
+                max_input_length=1024,
+                cache_key=cache_key,
+                cache_result=not sampling_requested(),
+                **deadline.apply(summary_generation)
+            )
 
         # Get user ID
         user_id = get_user_id()
 
-        # Update MongoDB history - Use consistent field name
-        user_history_collection.update_one(
-            {"documentId": doc_id, "userId": ObjectId(user_id)},
-            {"$set": {
+        def finish(summary):
+            advantages_text, disadvantages_text = list_texts()
+
+            # Improved parsing with regex to extract numbered items
+            advantages = []
+            adv_matches = re.findall(r'(?:\d+\.|\-|\|\•)\s([^\n\d\-\*\•]+)', advantages_text)
+            for match in adv_matches:
+                if match.strip():
+                    advantages.append(match.strip())
+            
+            # If regex failed to extract advantages, use the whole text
+            if not advantages and advantages_text.strip():
+                advantages = [advantages_text.strip()]
+            
+            # Use the same regex pattern for disadvantages
+            disadvantages = []
+            disadv_matches = re.findall(r'(?:\d+\.|\-|\|\•)\s([^\n\d\-\*\•]+)', disadvantages_text)
+            for match in disadv_matches:
+                if match.strip():
+                    disadvantages.append(match.strip())
+            
+            # If regex failed to extract disadvantages, use the whole text
+            if not disadvantages and disadvantages_text.strip():
+                disadvantages = [disadvantages_text.strip()]
+
+            # Update MongoDB history - Use consistent field name
+            user_history_collection.update_one(
+                {"documentId": doc_id, "userId": ObjectId(user_id)},
+                {"$set": {
+                    "summary": summary,
+                    "advantages": advantages,
+                    "limitations": disadvantages,
+                    "timestamp": datetime.utcnow()
+                }}
+            )
+
+            # Make sure documentId is included in response
+            return {
                 "summary": summary,
                 "advantages": advantages,
                 "limitations": disadvantages,
-                "timestamp": datetime.utcnow()
-            }}
-        )
+                "documentId": doc_id,  # Consistently use documentId in response
+                "documentTitle": filename
+            }
 
-        # Make sure documentId is included in response
-        return jsonify({
-            "summary": summary,
-            "advantages": advantages,
-            "limitations": disadvantages,
-            "documentId": doc_id,  # Consistently use documentId in response
-            "documentTitle": filename
-        })
+        if streaming:
+            # Stream the summary as it decodes; the lists finish alongside and arrive with "done"
+            def events():
+                if len(sections) > 1:
+                    yield "stage", {"stage": "sections", "sections": len(sections)}
+                prompt, _ = summary_input()
+                pieces = []
+                stream = scheduler.stream(
+                    prompt,
+                    max_input_length=1024,
+                    cache_result=not sampling_requested(),
+                    **deadline.apply(summary_generation)
+                )
+                try:
+                    for piece in stream:
+                        pieces.append(piece)
+                        yield "token", {"text": piece}
+                finally:
+                    # Also runs when the client disconnects: closing the stream stops its generation
+                    stream.close()
+                # Only a complete summary is saved, never a fragment over an earlier one
+                yield "done", finish("".join(pieces).strip())
+            return sse_response(events())
+
+        return jsonify(finish(summary_future.result()))
 
     except Exception as e:
         logger.error(f"Summary generation error: {str(e)}")
@@ -646,67 +1068,67 @@ def ask_question():
             return jsonify({"error": "Document ID required"}), 400
 
         # Generate question embedding
-        question_embedding = embedding_model.encode(question)
+        question_embedding = embedding_service.encode_query(question)
         
-        # Retrieve relevant chunks
-        results = collection.query(
-            query_embeddings=[question_embedding.tolist()],
-            n_results=3,  # Get top 3 most relevant chunks
-            where={"doc_id": doc_id}  # Filter by document
-        )
+        # Retrieve relevant chunks (vector and keyword matches, fused)
+        results = retrieve_chunks(question, question_embedding, get_user_id(), ASK_TOP_K, doc_id=doc_id)
         
-        if not results['documents'] or len(results['documents'][0]) == 0:
+        if not results:
             return jsonify({"error": "Document not found or no relevant content"}), 404
         
         # Combine relevant chunks into context
-        context = " ".join(results['documents'][0])
-        
-        # Get metadata (careful handling to avoid index errors)
-        if results['metadatas'] and len(results['metadatas']) > 0 and len(results['metadatas'][0]) > 0:
-            metadata = results['metadatas'][0][0]  # Get the first metadata entry
-            filename = metadata.get('source', 'unknown')
-        else:
-            filename = "unknown"
+        context = " ".join(result["document"] for result in results)
+        filename = results[0]["metadata"].get('source', 'unknown')
 
-        # Generate answer using combined context
-        inputs = tokenizer(
-            f"Answer this question based on the context:\nQuestion: {question}\nContext: {context}",
-            return_tensors="pt",
-            max_length=1024,
-            truncation=True
-        )
-        
-        answer_ids = model.generate(
-            inputs.input_ids, 
-            max_length=300, 
-            min_length=50,
-            num_beams=4,
-            temperature=0.7,
-            no_repeat_ngram_size=3
-        )
-        
-        answer = tokenizer.decode(answer_ids[0], skip_special_tokens=True)
+        prompt = f"Answer this question based on the context:\nQuestion: {question}\nContext: {context}"
+        answer_generation = generation_settings("answer")
 
         # Get user ID
         user_id = get_user_id()
 
-        # Update MongoDB with question/answer history - Using the same doc_id format
-        user_history_collection.update_one(
-            {"documentId": doc_id, "userId": ObjectId(user_id)},
-            {"$push": {"queries": {
-                "question": question,
-                "answer": answer,
-                "timestamp": datetime.utcnow()
-            }}}
-        )
+        def save_answer(answer):
+            # Update MongoDB with question/answer history - Using the same doc_id format
+            user_history_collection.update_one(
+                {"documentId": doc_id, "userId": ObjectId(user_id)},
+                {"$push": {"queries": {
+                    "question": question,
+                    "answer": answer,
+                    "timestamp": datetime.utcnow()
+                }}}
+            )
+            # Always include documentId in response
+            return {
+                "answer": answer, 
+                "context_used": len(context),
+                "documentId": doc_id,  # Consistently use documentId in response
+                "documentTitle": filename
+            }
 
-        # Always include documentId in response
-        return jsonify({
-            "answer": answer, 
-            "context_used": len(context),
-            "documentId": doc_id,  # Consistently use documentId in response
-            "documentTitle": filename
-        })
+        if stream_requested():
+            # Emit tokens as they decode; history is written once the answer is complete
+            def events():
+                pieces = []
+                stream = scheduler.stream(
+                    prompt, max_input_length=1024, cache_result=not sampling_requested(), **answer_generation
+                )
+                try:
+                    for piece in stream:
+                        pieces.append(piece)
+                        yield "token", {"text": piece}
+                finally:
+                    # Also runs when the client disconnects: closing the stream stops its generation
+                    stream.close()
+                yield "done", save_answer("".join(pieces).strip())
+            return sse_response(events())
+
+        # Generate answer using combined context
+        answer = scheduler.generate(
+            prompt,
+            max_input_length=1024,
+            cache_result=not sampling_requested(),
+            **answer_generation
+        )
+        return jsonify(save_answer(answer))
         
     except Exception as e:
         logger.error(f"Q&A error: {str(e)}")
@@ -778,14 +1200,12 @@ def get_document_details(doc_id):
         if not history_item:
             return jsonify({"error": "Document not found in history"}), 404
             
-        # Get full document text from ChromaDB
-        results = collection.get(where={"doc_id": doc_id}, include=["documents", "metadatas"])
+        # Get full document text
+        full_text, _ = load_document_text(doc_id, user_id)
         
-        if not results['documents'] or len(results['documents']) == 0:
-            return jsonify({"error": "Document not found in vector database"}), 404
+        if not full_text:
+            return jsonify({"error": "Document text not found"}), 404
             
-        # Add full text to response by joining all chunks
-        full_text = " ".join([item for sublist in results['documents'] for item in sublist])
         history_item['full_text'] = full_text
         
         # Ensure documentId is present in response
@@ -839,11 +1259,25 @@ def delete_document(doc_id):
         user_history_collection.delete_one({"documentId": doc_id, "userId": ObjectId(user_id)})
         
         # Delete from ChromaDB
-        collection.delete(where={"doc_id": doc_id})
+        partitions.collection(user_id).delete(where={"doc_id": doc_id})
+        partitions.keyword_index(user_id).remove(doc_id)
+
+        # Drop the stored text and cached encoder outputs for this document
+        document_store.delete(doc_id)
+        if encoder_cache is not None:
+            encoder_cache.drop_document(doc_id)
         
-        # Delete the physical file if it exists
+        # Delete the physical file if it exists and no other upload has the same content, including
+        # queued uploads that only write their history entry once ingestion finishes
         try:
-            if "documentTitle" in history_item:
+            if history_item.get("contentHash"):
+                content_hash = history_item["contentHash"]
+                if (not user_history_collection.count_documents({"contentHash": content_hash}, limit=1)
+                        and not ingestion_jobs.in_progress(content_hash)):
+                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], history_item["storedFile"])
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+            elif "documentTitle" in history_item:
                 file_path = os.path.join(app.config['UPLOAD_FOLDER'], history_item["documentTitle"])
                 if os.path.exists(file_path):
                     os.remove(file_path)
@@ -870,42 +1304,23 @@ def search_documents():
         # Get user ID
         user_id = get_user_id()
         
-        # Get user's document history
-        user_docs = list(user_history_collection.find(
-            {"userId": ObjectId(user_id)},
-            {"documentId": 1, "documentTitle": 1}
-        ))
-        
-        # Create list of document IDs
-        doc_ids = [doc["documentId"] for doc in user_docs]
-        
-        if not doc_ids:
-            return jsonify({"results": []}), 200
-        
         # Generate query embedding
-        query_embedding = embedding_model.encode(query)
+        query_embedding = embedding_service.encode_query(query)
         
-        # Search across all user documents
-        search_results = collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=5,
-            where={"doc_id": {"$in": doc_ids}}
-        )
+        # Search across all user documents (only this user's partition is touched)
+        search_results = retrieve_chunks(query, query_embedding, user_id, SEARCH_TOP_K)
         
         # Format results
         formatted_results = []
-        if search_results['documents'] and len(search_results['documents'][0]) > 0:
-            for i, (doc, metadata) in enumerate(zip(search_results['documents'][0], search_results['metadatas'][0])):
-                # Find document title
-                doc_id = metadata.get('doc_id')
-                doc_title = next((d["documentTitle"] for d in user_docs if d["documentId"] == doc_id), "Unknown")
-                
-                formatted_results.append({
-                    "documentId": doc_id,
-                    "documentTitle": doc_title,
-                    "relevance_score": search_results['distances'][0][i] if 'distances' in search_results else 0,
-                    "text_snippet": doc[:200] + "..." if len(doc) > 200 else doc
-                })
+        for result in search_results:
+            doc, metadata = result["document"], result["metadata"]
+            formatted_results.append({
+                "documentId": metadata.get('doc_id'),
+                "documentTitle": metadata.get('source', 'Unknown'),  # stored with every chunk at upload
+                "relevance_score": result["score"],  # fused rank score, higher is better
+                "distance": result["distance"],  # cosine distance, None for keyword-only matches
+                "text_snippet": doc[:200] + "..." if len(doc) > 200 else doc
+            })
         
         return jsonify({"results": formatted_results})
         
@@ -924,12 +1339,16 @@ def batch_upload():
     if not files or len(files) == 0:
         return jsonify({"error": "No files provided"}), 400
     
+    wait = wait_requested()
     results = []
     for file in files:
-        result, status_code = process_uploaded_document(file)
+        if wait:
+            result, status_code = process_uploaded_document(file)
+        else:
+            result, status_code = queue_uploaded_document(file)
         results.append({
             "filename": file.filename,
-            "status": "success" if status_code == 200 else "error",
+            "status": "error" if status_code >= 400 else ("success" if status_code == 200 else "queued"),
             "details": result
         })
     
@@ -937,73 +1356,140 @@ def batch_upload():
 
 @app.route('/compare', methods=['POST'])
 def compare_documents():
-    """Compare two documents and analyze similarities and differences"""
+    """Compare two or more documents and analyze similarities and differences"""
     try:
         data = request.get_json()
-        doc_id1 = data.get('documentId1')
-        doc_id2 = data.get('documentId2')
+        # {"documentIds": [...]} for N documents, documentId1/documentId2 for the original two
+        doc_ids = data.get('documentIds') or [data.get('documentId1'), data.get('documentId2')]
+        doc_ids = list(dict.fromkeys(doc_id for doc_id in doc_ids if doc_id))
         
-        if not doc_id1 or not doc_id2:
+        if len(doc_ids) < 2:
             return jsonify({"error": "Two document IDs are required"}), 400
+        if len(doc_ids) > COMPARE_MAX_DOCUMENTS:
+            return jsonify({"error": f"At most {COMPARE_MAX_DOCUMENTS} documents can be compared"}), 400
             
         # Get user ID
         user_id = get_user_id()
         
-        # Check if both documents belong to the user
-        doc1 = user_history_collection.find_one({"documentId": doc_id1, "userId": ObjectId(user_id)})
-        doc2 = user_history_collection.find_one({"documentId": doc_id2, "userId": ObjectId(user_id)})
-        
-        if not doc1 or not doc2:
-            return jsonify({"error": "One or both documents not found"}), 404
-            
-        # Get text from both documents
-        results1 = collection.get(where={"doc_id": doc_id1}, include=["documents"])
-        results2 = collection.get(where={"doc_id": doc_id2}, include=["documents"])
-        
-        if not results1['documents'] or not results2['documents']:
-            return jsonify({"error": "Document content not found"}), 404
-            
-        text1 = " ".join([item for sublist in results1['documents'] for item in sublist])
-        text2 = " ".join([item for sublist in results2['documents'] for item in sublist])
-        
-        # Limit text length for analysis
-        text1 = text1[:10000]
-        text2 = text2[:10000]
-        
-        # Generate comparison prompt
+        # Check that every document belongs to the user
+        history_items = {
+            item["documentId"]: item
+            for item in user_history_collection.find({"documentId": {"$in": doc_ids}, "userId": ObjectId(user_id)})
+        }
+        if len(history_items) != len(doc_ids):
+            return jsonify({"error": "One or more documents not found"}), 404
+        documents = [history_items[doc_id] for doc_id in doc_ids]
+
+        # Digests come from section summaries kept on each history entry per profile; missing
+        # ones are summarized for all documents together, under one deadline for the request
+        profile = requested_profile()
+        cache_result = not sampling_requested()
+        deadline = generation_profiles.deadline(profile)
+        stored_summaries, missing = [], []
+        for item in documents:
+            stored = (item.get("sectionSummaries") or {}).get(profile) if cache_result else None
+            if stored is None:
+                text, _ = load_document_text(item["documentId"], user_id)
+                if not text:
+                    return jsonify({"error": "Document content not found"}), 404
+                missing.append(summarizer.sections(text, document_sentences(item["documentId"])))
+            stored_summaries.append(stored)
+
+        # Interleave the documents' sections, so a deadline leaves every document some coverage
+        order = [
+            (doc, i)
+            for i in range(max(map(len, missing), default=0))
+            for doc, sections in enumerate(missing) if i < len(sections)
+        ]
+        summaries, complete = summarizer.summarize_sections(
+            [missing[doc][i] for doc, i in order], deadline,
+            cache_result=cache_result, **generation_settings("section")
+        )
+        by_missing = [[] for _ in missing]
+        for (doc, _), summary in zip(order, summaries):
+            by_missing[doc].append(summary)
+
+        reduce_generation = generation_settings("reduce")
+        digests = []
+        for item, stored in zip(documents, stored_summaries):
+            if stored is None:
+                stored = by_missing.pop(0)
+                # Only keep summaries of every section that were not cut short
+                if cache_result and complete:
+                    user_history_collection.update_one(
+                        {"_id": item["_id"]},
+                        {"$set": {f"sectionSummaries.{profile}": stored}}
+                    )
+            digests.append(summarizer.reduce(
+                stored,
+                COMPARE_DIGEST_TOKENS // len(documents),
+                cache_result=cache_result,
+                deadline=deadline,
+                **reduce_generation
+            ))
+
+        # Align chunk embeddings of all documents in one read of the user's partition
+        chunks = partitions.collection(user_id).get(
+            where={"doc_id": {"$in": doc_ids}},
+            include=["embeddings", "documents", "metadatas"]
+        )
+        by_document = {doc_id: [] for doc_id in doc_ids}
+        for embedding, chunk, metadata in zip(chunks['embeddings'], chunks['documents'], chunks['metadatas']):
+            by_document[metadata['doc_id']].append((metadata.get('chunk_id', 0), chunk, embedding))
+        for doc_chunks in by_document.values():
+            doc_chunks.sort(key=lambda item: item[0])
+        similar, unique = align_chunks([
+            np.array([embedding for _, _, embedding in by_document[doc_id]], dtype=np.float32)
+            for doc_id in doc_ids
+        ])
+
+        def chunk_excerpt(doc, index):
+            return excerpt(by_document[doc_ids[doc]][index][1])
+
+        titles = [item.get('documentTitle', f"Document {i + 1}") for i, item in enumerate(documents)]
+
+        # Generate comparison prompt - instructions, then the digests (reduce() caps each at its share of
+        # COMPARE_DIGEST_TOKENS, so all of them fit the 1024-token window), then passages that truncation may cut
         comparison_prompt = (
-            f"Compare and contrast these two documents.\n\n"
-            f"Document 1 ({doc1.get('documentTitle', 'Document 1')}):\n{text1}\n\n"
-            f"Document 2 ({doc2.get('documentTitle', 'Document 2')}):\n{text2}\n\n"
-            f"Provide a comprehensive analysis of:\n"
+            f"Compare and contrast these {len(documents)} documents. Provide a comprehensive analysis of:\n"
             f"1. Key similarities\n"
             f"2. Major differences\n"
-            f"3. Complementary insights\n"
+            f"3. Complementary insights\n\n"
         )
+        for i, (title, digest) in enumerate(zip(titles, digests)):
+            comparison_prompt += f"Document {i + 1} ({title}):\n{digest}\n\n"
+        if similar:
+            comparison_prompt += "Closely related passages:\n"
+            for _, a, i, b, j in similar:
+                comparison_prompt += (
+                    f"- Document {a + 1}: \"{chunk_excerpt(a, i)}\" / Document {b + 1}: \"{chunk_excerpt(b, j)}\"\n"
+                )
+        if unique:
+            comparison_prompt += "Passages found in only one document:\n"
+            for _, doc, i in unique:
+                comparison_prompt += f"- Document {doc + 1}: \"{chunk_excerpt(doc, i)}\"\n"
         
-        inputs = tokenizer(
+        comparison = scheduler.generate(
             comparison_prompt,
-            return_tensors="pt",
-            max_length=1024,
-            truncation=True
+            max_input_length=1024,
+            cache_result=cache_result,
+            **deadline.apply(generation_settings("compare"))
         )
         
-        comparison_ids = model.generate(
-            inputs.input_ids,
-            max_length=800,
-            min_length=300,
-            num_beams=4,
-            temperature=0.7,
-            no_repeat_ngram_size=3
-        )
-        
-        comparison = tokenizer.decode(comparison_ids[0], skip_special_tokens=True)
-        
-        return jsonify({
+        response = {
             "comparison": comparison,
-            "documentTitle1": doc1.get('documentTitle', 'Document 1'),
-            "documentTitle2": doc2.get('documentTitle', 'Document 2')
-        })
+            "documents": [
+                {"documentId": doc_id, "documentTitle": title} for doc_id, title in zip(doc_ids, titles)
+            ],
+            "alignedPassages": [
+                {"documentIds": [doc_ids[a], doc_ids[b]], "similarity": round(score, 3)}
+                for score, a, _, b, _ in similar
+            ]
+        }
+        # Keep documentTitle1, documentTitle2, ... for existing clients
+        for i, title in enumerate(titles):
+            response[f"documentTitle{i + 1}"] = title
+        return jsonify(response)
         
     except Exception as e:
         logger.error(f"Comparison error: {str(e)}")
@@ -1050,6 +1536,7 @@ Input content to summarize:
 
 # Run the Flask application
 if __name__ == '__main__':
-    # For production, consider using a WSGI server like Gunicorn
+    # For production use gunicorn with gunicorn.conf.py (gunicorn -c gunicorn.conf.py)
     port = int(os.environ.get('PORT', 5005))
+    startup.warm()
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,136 @@
+import os
+import logging
+
+from normalization import sentence_spans
+
+logger = logging.getLogger(__name__)
+
+# Chunking configuration, overridable from the environment
+CHUNK_MAX_TOKENS = int(os.environ.get('CHUNK_MAX_TOKENS', 0))  # 0 = the embedding model's own limit
+CHUNK_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', 32))
+
+
+class SentenceChunker:
+    """Packs whole sentences into chunks that fit the embedding model's token window.
+
+    Token counts come from the embedding model's own tokenizer, so every chunk is
+    embedded in full. Chunks carry their character offsets in the cleaned document
+    text, and consecutive chunks share up to `overlap_tokens` tokens of trailing
+    sentences. Each sentence is tokenized once, so the whole pass is linear in the
+    length of the text. The sentence spans and token counts can be recorded and
+    handed back later, so re-chunking the same text skips the tokenizer.
+    """
+
+    def __init__(self, tokenizer, max_tokens, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        self.tokenizer = tokenizer
+        self.max_tokens = max(1, int(max_tokens))
+        self.overlap_tokens = max(0, min(int(overlap_tokens), self.max_tokens // 2))
+
+    def chunk_text(self, text):
+        """Chunk one cleaned text, yields (chunk, char_start, char_end)"""
+        return self.chunk_pages([(1, text)])
+
+    def chunk_pages(self, pages, sentences=None):
+        """Chunk (page_number, text) pages joined by single spaces, yields (chunk, char_start, char_end).
+
+        If `sentences` is a list, [char_start, char_end, token_count] of every sentence is
+        appended to it, for chunk_sentences.
+        """
+        tokenized = self._sentences(pages)
+        if sentences is not None:
+            tokenized = self._recorded(tokenized, sentences)
+        return self._pack(tokenized)
+
+    def chunk_sentences(self, text, sentences):
+        """Chunk a text with the sentences recorded by chunk_pages, yields (chunk, char_start, char_end).
+
+        Only sentences longer than max_tokens are tokenized again, for their token offsets.
+        """
+        return self._pack(self._cached(text, sentences))
+
+    def _sentences(self, pages):
+        # Yields (char_start, text, token_count, token_offsets) for every sentence. The
+        # unterminated tail of each page is carried over, since sentences cross pages.
+        carry, carry_start = "", 0
+        page_start = 0
+        for _, page_text in pages:
+            if carry:
+                work, work_start = f"{carry} {page_text}", carry_start
+            else:
+                work, work_start = page_text, page_start
+            page_start += len(page_text) + 1
+
+            spans = sentence_spans(work)
+            carry = ""
+            if spans and not work[spans[-1][1] - 1] in '.!?':
+                start, end = spans.pop()
+                carry, carry_start = work[start:end], work_start + start
+            yield from self._tokenized(work, work_start, spans)
+
+        if carry:
+            yield from self._tokenized(carry, carry_start, [(0, len(carry))])
+
+    def _tokenized(self, text, text_start, spans):
+        if not spans:
+            return
+        sentences = [text[start:end] for start, end in spans]
+        encoded = self.tokenizer(sentences, add_special_tokens=False, return_offsets_mapping=True)
+        for (start, _), sentence, offsets in zip(spans, sentences, encoded["offset_mapping"]):
+            yield text_start + start, sentence, len(offsets), offsets
+
+    @staticmethod
+    def _recorded(sentences, record):
+        for sentence in sentences:
+            start, text, count, _ = sentence
+            record.append([start, start + len(text), count])
+            yield sentence
+
+    def _cached(self, text, sentences):
+        for start, end, count in sentences:
+            sentence = text[start:end]
+            offsets = None
+            if count > self.max_tokens:
+                offsets = self.tokenizer(sentence, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+            yield start, sentence, count, offsets
+
+    def _pack(self, sentences):
+        current, tokens = [], 0
+        for sentence in sentences:
+            start, text, count, offsets = sentence
+
+            if count > self.max_tokens:
+                # A single sentence longer than the window is cut at token boundaries
+                if current:
+                    yield self._emit(current)
+                    current, tokens = [], 0
+                for i in range(0, count, self.max_tokens):
+                    window = offsets[i:i + self.max_tokens]
+                    piece_start, piece_end = window[0][0], window[-1][1]
+                    yield text[piece_start:piece_end], start + piece_start, start + piece_end
+                continue
+
+            if current and tokens + count > self.max_tokens:
+                yield self._emit(current)
+                # Carry trailing sentences into the next chunk as overlap
+                kept, kept_tokens = [], 0
+                for previous in reversed(current):
+                    if kept_tokens + previous[2] > self.overlap_tokens:
+                        break
+                    kept.append(previous)
+                    kept_tokens += previous[2]
+                kept.reverse()
+                current, tokens = kept, kept_tokens
+                if tokens + count > self.max_tokens:
+                    current, tokens = [], 0
+
+            current.append(sentence)
+            tokens += count
+
+        if current:
+            yield self._emit(current)
+
+    @staticmethod
+    def _emit(sentences):
+        text = " ".join(sentence[1] for sentence in sentences)
+        start = sentences[0][0]
+        return text, start, start + len(text)
@@ -0,0 +1,71 @@
+import os
+from itertools import combinations
+
+import numpy as np
+
+# Comparison configuration, overridable from the environment
+COMPARE_MAX_DOCUMENTS = int(os.environ.get('COMPARE_MAX_DOCUMENTS', 5))
+COMPARE_SIMILAR_PAIRS = int(os.environ.get('COMPARE_SIMILAR_PAIRS', 3))
+# Cosine similarity a chunk pair needs to count as closely related
+COMPARE_MIN_SIMILARITY = float(os.environ.get('COMPARE_MIN_SIMILARITY', 0.5))
+COMPARE_UNIQUE_PER_DOCUMENT = int(os.environ.get('COMPARE_UNIQUE_PER_DOCUMENT', 1))
+COMPARE_EXCERPT_WORDS = int(os.environ.get('COMPARE_EXCERPT_WORDS', 30))
+
+
+def excerpt(text, words=COMPARE_EXCERPT_WORDS):
+    parts = text.split()
+    return " ".join(parts[:words]) + (" ..." if len(parts) > words else "")
+
+
+def _normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def align_chunks(embeddings, max_similar=COMPARE_SIMILAR_PAIRS, unique_per_document=COMPARE_UNIQUE_PER_DOCUMENT,
+                 min_similarity=COMPARE_MIN_SIMILARITY):
+    """Find the closest chunk pairs between documents and each document's least-covered chunks.
+
+    `embeddings` is a list with one (n_chunks, dim) array per document. Each pair of
+    documents gets one cosine similarity matrix. Returns
+    - similar: up to `max_similar` (score, doc_a, chunk_a, doc_b, chunk_b) across all
+      document pairs scoring at least `min_similarity`, best first, at most one per chunk;
+    - unique: per document, up to `unique_per_document` (score, doc, chunk) whose best
+      match in any other document is weakest, i.e. content the others do not cover.
+    """
+    matrices = [_normalized(vectors) if len(vectors) else None for vectors in embeddings]
+    best_elsewhere = [np.full(len(vectors), -1.0, dtype=np.float32) for vectors in embeddings]
+
+    candidates = []
+    for a, b in combinations(range(len(matrices)), 2):
+        if matrices[a] is None or matrices[b] is None:
+            continue
+        similarity = matrices[a] @ matrices[b].T
+        best_elsewhere[a] = np.maximum(best_elsewhere[a], similarity.max(axis=1))
+        best_elsewhere[b] = np.maximum(best_elsewhere[b], similarity.max(axis=0))
+
+        # Top cells of this matrix, enough to fill max_similar after deduplication
+        flat = similarity.ravel()
+        top = min(len(flat), max_similar * 4)
+        for index in np.argpartition(-flat, top - 1)[:top]:
+            if flat[index] < min_similarity:
+                continue
+            i, j = divmod(int(index), similarity.shape[1])
+            candidates.append((float(flat[index]), a, i, b, j))
+
+    similar, used = [], set()
+    for score, a, i, b, j in sorted(candidates, reverse=True):
+        if (a, i) in used or (b, j) in used:
+            continue
+        similar.append((score, a, i, b, j))
+        used.update(((a, i), (b, j)))
+        if len(similar) >= max_similar:
+            break
+
+    unique = []
+    for doc, scores in enumerate(best_elsewhere):
+        for i in np.argsort(scores)[:unique_per_document]:
+            if (doc, int(i)) not in used:
+                unique.append((float(scores[i]), doc, int(i)))
+    return similar, unique
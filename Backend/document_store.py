@@ -0,0 +1,138 @@
+import os
+import json
+import zlib
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Document store configuration, overridable from the environment
+DOCUMENT_STORE_DIR = os.environ.get('DOCUMENT_STORE_DIR', 'document_store')
+DOCUMENT_STORE_BLOCK_CHARS = int(os.environ.get('DOCUMENT_STORE_BLOCK_CHARS', 16384))
+
+_HEADER_SIZE = struct.Struct('>I')
+
+
+class DocumentStore:
+    """Cleaned full text of each document, stored as one compressed file per documentId.
+
+    The text is cut into fixed-size character blocks that are compressed separately,
+    so a ranged read such as "first 8000 characters" only reads and decompresses the
+    blocks it touches. File layout: 4-byte header length, JSON header, blocks.
+    """
+
+    def __init__(self, root=DOCUMENT_STORE_DIR, block_chars=DOCUMENT_STORE_BLOCK_CHARS):
+        self.root = root
+        self.block_chars = max(1, int(block_chars))
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, doc_id):
+        # Document ids are UUIDs, but never let a crafted id escape the store directory
+        return os.path.join(self.root, f"{doc_id.replace(os.sep, '_').replace('..', '_')}.doc")
+
+    def put(self, doc_id, text, metadata=None):
+        blocks = [
+            zlib.compress(text[i:i + self.block_chars].encode('utf-8'))
+            for i in range(0, len(text), self.block_chars)
+        ]
+        header = json.dumps({
+            "length": len(text),
+            "block_chars": self.block_chars,
+            "block_sizes": [len(block) for block in blocks],
+            "metadata": metadata or {}
+        }).encode('utf-8')
+
+        path = self._path(doc_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(_HEADER_SIZE.pack(len(header)))
+            file.write(header)
+            for block in blocks:
+                file.write(block)
+        os.replace(tmp_path, path)
+
+    def exists(self, doc_id):
+        return os.path.exists(self._path(doc_id))
+
+    def metadata(self, doc_id):
+        """Return the metadata stored with a document, or None if it is unknown"""
+        try:
+            with open(self._path(doc_id), 'rb') as file:
+                return self._read_header(file)["metadata"]
+        except FileNotFoundError:
+            return None
+
+    def length(self, doc_id):
+        try:
+            with open(self._path(doc_id), 'rb') as file:
+                return self._read_header(file)["length"]
+        except FileNotFoundError:
+            return None
+
+    def get(self, doc_id, start=0, end=None):
+        """Return text[start:end] of a document, or None if it is unknown"""
+        return self.get_with_metadata(doc_id, start, end)[0]
+
+    def get_with_metadata(self, doc_id, start=0, end=None):
+        """Return (text[start:end], metadata) of a document, or (None, None) if it is unknown"""
+        try:
+            file = open(self._path(doc_id), 'rb')
+        except FileNotFoundError:
+            return None, None
+
+        with file:
+            header = self._read_header(file)
+            length = header["length"]
+            block_chars = header["block_chars"]
+            end = length if end is None else max(0, min(end, length))
+            start = max(0, min(start, end))
+            if start == end:
+                return "", header["metadata"]
+
+            first_block = start // block_chars
+            last_block = (end - 1) // block_chars
+            sizes = header["block_sizes"]
+            file.seek(sum(sizes[:first_block]), os.SEEK_CUR)
+            parts = [
+                zlib.decompress(file.read(sizes[i])).decode('utf-8')
+                for i in range(first_block, last_block + 1)
+            ]
+
+        offset = first_block * block_chars
+        return "".join(parts)[start - offset:end - offset], header["metadata"]
+
+    def copy(self, source_id, doc_id, metadata=None):
+        """Store the text of source_id again under doc_id, updating its metadata with `metadata`.
+
+        Blocks are copied still compressed. Returns False if source_id is unknown.
+        """
+        try:
+            file = open(self._path(source_id), 'rb')
+        except FileNotFoundError:
+            return False
+
+        with file:
+            header = self._read_header(file)
+            blocks = file.read()
+        header["metadata"] = {**header["metadata"], **(metadata or {})}
+        header = json.dumps(header).encode('utf-8')
+
+        path = self._path(doc_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(_HEADER_SIZE.pack(len(header)))
+            file.write(header)
+            file.write(blocks)
+        os.replace(tmp_path, path)
+        return True
+
+    def delete(self, doc_id):
+        try:
+            os.remove(self._path(doc_id))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _read_header(file):
+        (size,) = _HEADER_SIZE.unpack(file.read(_HEADER_SIZE.size))
+        return json.loads(file.read(size).decode('utf-8'))
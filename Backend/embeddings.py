@@ -0,0 +1,245 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from normalization import collapse_whitespace
+
+logger = logging.getLogger(__name__)
+
+# Embedding service tuning, overridable from the environment
+EMBEDDING_ENCODE_BATCH_SIZE = int(os.environ.get('EMBEDDING_ENCODE_BATCH_SIZE', 32))
+EMBEDDING_PRECISION = os.environ.get('EMBEDDING_PRECISION', 'float32')
+EMBEDDING_QUERY_WAIT_MS = float(os.environ.get('EMBEDDING_QUERY_WAIT_MS', 5))
+EMBEDDING_MAX_QUERY_BATCH = int(os.environ.get('EMBEDDING_MAX_QUERY_BATCH', 64))
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 4096))
+
+_PRECISIONS = {'float32': np.float32, 'float16': np.float16}
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU cache of query text -> embedding vector.
+
+    Vectors live in one preallocated contiguous float32 array of shape
+    (capacity, dim); the LRU only maps normalized query text to a row index.
+    """
+
+    def __init__(self, capacity=QUERY_CACHE_SIZE):
+        self.capacity = max(1, int(capacity))
+        self._vectors = None  # allocated on first put, once the dimension is known
+        self._slots = OrderedDict()  # normalized text -> row in self._vectors
+        self._free = list(range(self.capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text):
+        # MiniLM is uncased, so case and spacing differences map to the same embedding
+        return collapse_whitespace(text).lower()
+
+    def get(self, text):
+        key = self.normalize(text)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                self.misses += 1
+                return None
+            self._slots.move_to_end(key)
+            self.hits += 1
+            return self._vectors[slot].copy()
+
+    def put(self, text, vector):
+        key = self.normalize(text)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, len(vector)), dtype=np.float32)
+            slot = self._slots.get(key)
+            if slot is None:
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    _, slot = self._slots.popitem(last=False)
+            self._slots[key] = slot
+            self._slots.move_to_end(key)
+            self._vectors[slot] = vector
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._slots),
+                "capacity": self.capacity,
+                "bytes": self._vectors.nbytes if self._vectors is not None else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0
+            }
+
+
+class EmbeddingService:
+    """Wraps the SentenceTransformer model for chunk and query embeddings.
+
+    Chunks are sorted by length and encoded in fixed-size batches so each batch
+    pads to similar lengths. Query encodes from concurrent requests arriving within
+    `query_wait_ms` of each other are coalesced into one forward pass.
+    Repeated queries are answered from `query_cache` without touching the model.
+    `metrics_hook(event, data)` is called after every document batch and query batch.
+    """
+
+    def __init__(self, model, batch_size=EMBEDDING_ENCODE_BATCH_SIZE, precision=EMBEDDING_PRECISION,
+                 query_wait_ms=EMBEDDING_QUERY_WAIT_MS, max_query_batch=EMBEDDING_MAX_QUERY_BATCH,
+                 metrics_hook=None, query_cache=None):
+        if precision not in _PRECISIONS:
+            raise ValueError(f"Unsupported embedding precision: {precision}")
+        self.model = model
+        self.batch_size = max(1, int(batch_size))
+        self.dtype = _PRECISIONS[precision]
+        self.query_wait = max(0.0, float(query_wait_ms)) / 1000.0
+        self.max_query_batch = max(1, int(max_query_batch))
+        self.metrics_hook = metrics_hook
+        self.query_cache = query_cache
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._worker = None
+        self._worker_pid = None
+
+        # Metrics
+        self._lock = threading.Lock()
+        self._chunks = 0
+        self._chunk_seconds = 0.0
+        self._queries = 0
+        self._query_batches = 0
+        self._query_latency = 0.0
+        self._max_query_latency = 0.0
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode_documents(self, texts):
+        """Embed a list of chunks, returned in input order as an (n, dim) array"""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=self.dtype)
+
+        started = time.monotonic()
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        embeddings = np.empty((len(texts), self.dimension), dtype=self.dtype)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            embeddings[batch] = self._encode([texts[i] for i in batch])
+        elapsed = time.monotonic() - started
+
+        with self._lock:
+            self._chunks += len(texts)
+            self._chunk_seconds += elapsed
+        self._emit("documents", {
+            "chunks": len(texts),
+            "seconds": elapsed,
+            "chunks_per_sec": len(texts) / elapsed if elapsed else None
+        })
+        return embeddings
+
+    def encode_query(self, text):
+        """Embed one query string, sharing a forward pass with concurrent queries"""
+        if self.query_cache is not None:
+            cached = self.query_cache.get(text)
+            if cached is not None:
+                return cached.astype(self.dtype, copy=False)
+
+        future = Future()
+        with self._condition:
+            self._ensure_worker()
+            self._pending.append((text, future, time.monotonic()))
+            self._condition.notify()
+        return future.result()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "chunks": self._chunks,
+                "chunks_per_sec": round(self._chunks / self._chunk_seconds, 2) if self._chunk_seconds else 0,
+                "queries": self._queries,
+                "query_batches": self._query_batches,
+                "avg_query_batch_size": round(self._queries / self._query_batches, 2) if self._query_batches else 0,
+                "avg_query_latency_ms": round(1000 * self._query_latency / self._queries, 2) if self._queries else 0,
+                "max_query_latency_ms": round(1000 * self._max_query_latency, 2),
+                "query_cache": self.query_cache.stats() if self.query_cache is not None else None,
+                "config": {
+                    "batch_size": self.batch_size,
+                    "precision": np.dtype(self.dtype).name,
+                    "query_wait_ms": self.query_wait * 1000
+                }
+            }
+
+    def _encode(self, texts):
+        return self.model.encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ).astype(self.dtype, copy=False)
+
+    def _emit(self, event, data):
+        if self.metrics_hook is None:
+            return
+        try:
+            self.metrics_hook(event, data)
+        except Exception as e:
+            logger.warning(f"Embedding metrics hook error: {str(e)}")
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so (re)start the worker lazily in each process
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        self._worker_pid = os.getpid()
+        self._worker = threading.Thread(target=self._run, name="query-embedder", daemon=True)
+        self._worker.start()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = self._pending[0][2] + self.query_wait
+            while len(self._pending) < self.max_query_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self.max_query_batch]
+            del self._pending[:self.max_query_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                vectors = self._encode([text for text, _, _ in batch])
+            except Exception as e:
+                logger.error(f"Query embedding failed ({len(batch)} queries): {str(e)}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            finished = time.monotonic()
+            for (text, future, _), vector in zip(batch, vectors):
+                if self.query_cache is not None:
+                    self.query_cache.put(text, vector)
+                future.set_result(vector)
+
+            latencies = [finished - enqueued for _, _, enqueued in batch]
+            with self._lock:
+                self._queries += len(batch)
+                self._query_batches += 1
+                self._query_latency += sum(latencies)
+                self._max_query_latency = max(self._max_query_latency, max(latencies))
+            self._emit("queries", {
+                "batch_size": len(batch),
+                "max_latency_ms": 1000 * max(latencies)
+            })
@@ -0,0 +1,187 @@
+import os
+import shutil
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Encoder cache configuration, overridable from the environment
+ENCODER_CACHE_DIR = os.environ.get('ENCODER_CACHE_DIR', 'encoder_cache')
+ENCODER_CACHE_MEMORY_MB = float(os.environ.get('ENCODER_CACHE_MEMORY_MB', 256))
+ENCODER_CACHE_DISK_MB = float(os.environ.get('ENCODER_CACHE_DISK_MB', 2048))
+
+
+class EncoderCache:
+    """LRU + on-disk cache of T5 encoder hidden states.
+
+    Entries are keyed by (doc_id, prompt template, truncation length) and stored as
+    unpadded [seq_len, d_model] tensors. Files live under <cache_dir>/<doc_id>/ so
+    that all entries of a document can be dropped at once when it is deleted.
+    """
+
+    def __init__(self, cache_dir=ENCODER_CACHE_DIR, max_memory_bytes=ENCODER_CACHE_MEMORY_MB * 1024 * 1024,
+                 max_disk_bytes=ENCODER_CACHE_DISK_MB * 1024 * 1024, namespace=""):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = int(max_memory_bytes)
+        self.max_disk_bytes = int(max_disk_bytes)
+        # Namespace (e.g. the model id) keeps hidden states of different models apart
+        self.namespace = namespace
+
+        self._entries = OrderedDict()  # (doc_dir, digest) -> hidden states
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._disk_bytes = self._scan_disk_usage()
+
+    def _key(self, cache_key):
+        doc_id, template, truncation = cache_key
+        digest = hashlib.sha256(
+            f"{self.namespace}\x00{template}\x00{truncation}".encode('utf-8')
+        ).hexdigest()[:32]
+        return doc_id, digest
+
+    def _path(self, doc_dir, digest):
+        return os.path.join(self.cache_dir, _secure_dir_name(doc_dir), f"{digest}.pt")
+
+    def get(self, cache_key):
+        """Return the cached hidden states for cache_key, or None"""
+        doc_dir, digest = self._key(cache_key)
+        key = (doc_dir, digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        path = self._path(doc_dir, digest)
+        if os.path.exists(path):
+            try:
+                hidden = torch.load(path, map_location='cpu', weights_only=True)
+            except Exception as e:
+                logger.warning(f"Encoder cache read error: {str(e)}")
+                hidden = None
+            if hidden is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, hidden)
+                return hidden
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, cache_key, hidden):
+        """Store unpadded [seq_len, d_model] hidden states in memory and on disk"""
+        doc_dir, digest = self._key(cache_key)
+        key = (doc_dir, digest)
+        hidden = hidden.detach().to('cpu').contiguous().clone()
+        with self._lock:
+            self._remember(key, hidden)
+
+        path = self._path(doc_dir, digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            torch.save(hidden, tmp_path)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_bytes += os.path.getsize(path)
+                over_budget = self._disk_bytes > self.max_disk_bytes
+            if over_budget:
+                self._evict_disk()
+        except Exception as e:
+            logger.warning(f"Encoder cache write error: {str(e)}")
+
+    def drop_document(self, doc_id):
+        """Remove every entry (in memory and on disk) of doc_id"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == doc_id]:
+                self._memory_bytes -= _nbytes(self._entries.pop(key))
+
+        path = os.path.join(self.cache_dir, _secure_dir_name(doc_id))
+        if os.path.isdir(path):
+            size = _dir_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            with self._lock:
+                self._disk_bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0
+            }
+
+    def _remember(self, key, hidden):
+        # Caller holds the lock
+        if key in self._entries:
+            self._memory_bytes -= _nbytes(self._entries.pop(key))
+        self._entries[key] = hidden
+        self._memory_bytes += _nbytes(hidden)
+        while self._memory_bytes > self.max_memory_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= _nbytes(evicted)
+
+    def _evict_disk(self):
+        # Remove least recently written files until the cache fits its disk budget
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+        with self._lock:
+            self._disk_bytes = total
+
+    def _scan_disk_usage(self):
+        return _dir_size(self.cache_dir)
+
+
+def _secure_dir_name(name):
+    # Document ids are UUIDs, but never let a crafted id escape the cache directory
+    return name.replace(os.sep, '_').replace('..', '_')
+
+
+def _nbytes(tensor):
+    return tensor.element_size() * tensor.nelement()
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+    return total
@@ -0,0 +1,151 @@
+import os
+import copy
+import json
+import math
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Generation profile configuration, overridable from the environment
+GENERATION_PROFILE = os.environ.get('GENERATION_PROFILE', 'balanced')
+GENERATION_PROFILES_FILE = os.environ.get('GENERATION_PROFILES_FILE')
+# Smallest max_time a call still gets once its request's deadline is (nearly) used up
+GENERATION_MIN_TIME_S = float(os.environ.get('GENERATION_MIN_TIME_S', 5))
+
+# Settings with no meaning once decoding is sampled from a single beam
+BEAM_ONLY_KWARGS = ('num_beams', 'length_penalty', 'early_stopping', 'num_beam_groups', 'diversity_penalty')
+
+# Every profile decodes deterministically with beam search (or greedily); sampling is
+# only used when a request asks for it, and then without beams. `max_time` is the
+# wall-clock budget in seconds: generate() stops there and returns the best hypothesis
+# found so far. A request that makes several calls shares one max_time across them
+# through a Deadline.
+DEFAULT_PROFILES = {
+    "fast": {
+        "max_time": 15,
+        "sampling": {"temperature": 0.7, "top_p": 0.9},
+        "tasks": {
+            "section": {"max_length": 96, "min_length": 24, "num_beams": 1, "no_repeat_ngram_size": 3},
+            "reduce": {"max_length": 160, "min_length": 40, "num_beams": 1, "no_repeat_ngram_size": 3},
+            "summary": {"max_length": 400, "min_length": 150, "num_beams": 1, "no_repeat_ngram_size": 3,
+                        "repetition_penalty": 1.2},
+            "text_summary": {"max_length": 250, "min_length": 80, "num_beams": 1, "no_repeat_ngram_size": 3,
+                             "repetition_penalty": 2.5},
+            "list": {"max_length": 150, "num_beams": 1, "no_repeat_ngram_size": 2},
+            "answer": {"max_length": 200, "min_length": 20, "num_beams": 1, "no_repeat_ngram_size": 3},
+            "compare": {"max_length": 400, "min_length": 120, "num_beams": 1, "no_repeat_ngram_size": 3}
+        }
+    },
+    "balanced": {
+        "max_time": 45,
+        "sampling": {"temperature": 0.7, "top_p": 0.9},
+        "tasks": {
+            "section": {"max_length": 128, "min_length": 32, "num_beams": 2, "no_repeat_ngram_size": 3},
+            "reduce": {"max_length": 200, "min_length": 48, "num_beams": 2, "no_repeat_ngram_size": 3},
+            "summary": {"max_length": 600, "min_length": 300, "num_beams": 3, "length_penalty": 1.5,
+                        "no_repeat_ngram_size": 3, "repetition_penalty": 1.2},
+            "text_summary": {"max_length": 400, "min_length": 150, "num_beams": 3, "length_penalty": 1.5,
+                             "no_repeat_ngram_size": 3, "repetition_penalty": 2.5, "early_stopping": True},
+            "list": {"max_length": 200, "num_beams": 3, "no_repeat_ngram_size": 2},
+            "answer": {"max_length": 300, "min_length": 50, "num_beams": 3, "no_repeat_ngram_size": 3},
+            "compare": {"max_length": 600, "min_length": 200, "num_beams": 3, "no_repeat_ngram_size": 3}
+        }
+    },
+    "quality": {
+        "max_time": 120,
+        "sampling": {"temperature": 0.7, "top_p": 0.9},
+        "tasks": {
+            "section": {"max_length": 160, "min_length": 48, "num_beams": 4, "no_repeat_ngram_size": 3},
+            "reduce": {"max_length": 256, "min_length": 64, "num_beams": 4, "no_repeat_ngram_size": 3},
+            "summary": {"max_length": 800, "min_length": 600, "num_beams": 5, "length_penalty": 2.0,
+                        "no_repeat_ngram_size": 3, "repetition_penalty": 1.2},
+            "text_summary": {"max_length": 400, "min_length": 200, "num_beams": 5, "length_penalty": 1.5,
+                             "no_repeat_ngram_size": 3, "repetition_penalty": 2.5, "early_stopping": True},
+            "list": {"max_length": 200, "num_beams": 4, "no_repeat_ngram_size": 2},
+            "answer": {"max_length": 300, "min_length": 50, "num_beams": 4, "no_repeat_ngram_size": 3},
+            "compare": {"max_length": 800, "min_length": 300, "num_beams": 4, "no_repeat_ngram_size": 3}
+        }
+    }
+}
+
+
+class Deadline:
+    """Wall-clock budget of one request, shared by every generate call the request makes"""
+
+    def __init__(self, seconds, floor=GENERATION_MIN_TIME_S):
+        self.expires = time.monotonic() + seconds if seconds else None
+        self.floor = floor
+
+    def remaining(self):
+        return None if self.expires is None else self.expires - time.monotonic()
+
+    @property
+    def expired(self):
+        return self.expires is not None and self.remaining() <= 0
+
+    def apply(self, settings):
+        """generate() settings with max_time set to what is left of the budget (at least the floor)"""
+        if self.expires is None:
+            return settings
+        # Whole seconds; batching ignores max_time, each batch runs under its members' smallest one
+        return dict(settings, max_time=max(math.ceil(self.remaining()), self.floor))
+
+
+class GenerationProfiles:
+    """Named decoding settings per task.
+
+    Tasks: "summary", "text_summary", "list", "answer", "compare", and the "section"
+    (map) and "reduce" steps of hierarchical summarization.
+
+    Profiles from `profiles_file` (JSON, same shape as DEFAULT_PROFILES) are merged over
+    the defaults, so a deployment can tune a single value or add whole new profiles.
+    """
+
+    def __init__(self, default=GENERATION_PROFILE, profiles_file=GENERATION_PROFILES_FILE):
+        self.profiles = copy.deepcopy(DEFAULT_PROFILES)
+        if profiles_file:
+            with open(profiles_file, 'r', encoding='utf-8') as file:
+                self._merge(json.load(file))
+        if default not in self.profiles:
+            raise ValueError(f"Unknown default generation profile '{default}'")
+        self.default = default
+
+    def names(self):
+        return sorted(self.profiles)
+
+    def resolve(self, name=None):
+        """Return a known profile name, falling back to the default"""
+        if not name:
+            return self.default
+        if name not in self.profiles:
+            logger.warning(f"Unknown generation profile '{name}', using '{self.default}'")
+            return self.default
+        return name
+
+    def settings(self, task, name=None, sample=False):
+        """generate() keyword arguments for a task under the named profile"""
+        profile = self.profiles[self.resolve(name)]
+        settings = dict(profile["tasks"].get(task) or self.profiles[self.default]["tasks"][task])
+        if profile.get("max_time"):
+            settings.setdefault("max_time", profile["max_time"])
+        if sample:
+            settings = {k: v for k, v in settings.items() if k not in BEAM_ONLY_KWARGS}
+            settings.update(profile.get("sampling", {}), do_sample=True)
+        return settings
+
+    def deadline(self, name=None):
+        """A Deadline for one request under the named profile's max_time"""
+        return Deadline(self.profiles[self.resolve(name)].get("max_time"))
+
+    def _merge(self, overrides):
+        for name, override in overrides.items():
+            profile = self.profiles.setdefault(name, {"max_time": None, "sampling": {}, "tasks": {}})
+            for key, value in override.items():
+                if key == "tasks":
+                    for task, task_settings in value.items():
+                        profile["tasks"].setdefault(task, {}).update(task_settings)
+                elif key == "sampling":
+                    profile["sampling"].update(value)
+                else:
+                    profile[key] = value
@@ -0,0 +1,23 @@
+import os
+
+# Gunicorn configuration, overridable from the environment
+bind = f"0.0.0.0:{os.environ.get('PORT', 5005)}"
+wsgi_app = 'chat:app'
+# Set the worker count here rather than with -w: it is exported so chat.py can check that
+# the vector store is shared between the workers, and ocr.py splits its host-wide OCR
+# threads and memory ceiling between them
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+os.environ['GUNICORN_WORKERS'] = str(workers)
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+
+# Import chat.py once in the master: with STARTUP_MODE=eager the models are loaded there and
+# the forked workers share the weights copy-on-write instead of each loading its own copy
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def post_worker_init(worker):
+    # Open this worker's Chroma and Mongo connections (and, in lazy mode, load the models)
+    # in the background now rather than on the first request; /ready reports when it is done
+    from chat import startup
+    startup.warm()
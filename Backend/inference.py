@@ -0,0 +1,412 @@
+import os
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from transformers.modeling_outputs import BaseModelOutput
+
+from generation_profiles import BEAM_ONLY_KWARGS
+
+logger = logging.getLogger(__name__)
+
+# Scheduler tuning, overridable from the environment
+DEFAULT_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 8))
+DEFAULT_BATCH_WAIT_MS = float(os.environ.get('INFERENCE_BATCH_WAIT_MS', 25))
+STREAM_TIMEOUT_S = float(os.environ.get('INFERENCE_STREAM_TIMEOUT_S', 300))
+
+
+class _GenerationRequest:
+    """A single tokenized prompt waiting for a batched generate call"""
+
+    __slots__ = ('input_ids', 'max_input_length', 'generate_kwargs', 'cache_key', 'result_key', 'key', 'future',
+                 'enqueued_at')
+
+    def __init__(self, input_ids, max_input_length, generate_kwargs, cache_key=None, result_key=None):
+        self.input_ids = input_ids
+        self.cache_key = cache_key
+        self.result_key = result_key
+        self.max_input_length = max_input_length
+        self.generate_kwargs = generate_kwargs
+        # Requests can only share a batch when they decode with the same settings; max_time
+        # differs per request deadline, and a batch runs under its members' smallest one
+        self.key = (max_input_length, tuple(sorted((k, v) for k, v in generate_kwargs.items() if k != 'max_time')))
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class _StopOnEvent(StoppingCriteria):
+    """Ends generation at the next decoding step once `event` is set"""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), device=input_ids.device, dtype=torch.bool)
+
+
+class InferenceScheduler:
+    """Queues prompts from all routes and runs them through model.generate in padded batches.
+
+    Compatible requests (same truncation length and generation config) that arrive
+    within `max_wait_ms` of the oldest queued request are grouped into one batch.
+    Their max_time may differ: the batch runs with the smallest of them.
+    When an EncoderCache is attached, requests submitted with a cache_key reuse
+    previously computed encoder hidden states instead of re-running the encoder.
+    When a ResultCache is attached, requests submitted with cache_result=True are
+    answered from it before tokenization, and fresh results are stored in it, except
+    results that generate() may have cut short at their `max_time`. Futures of such
+    results have `truncated` set.
+    stream() bypasses the batch queue and yields decoded text as it is generated;
+    closing the generator early stops the generation.
+    """
+
+    def __init__(self, tokenizer, model, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_BATCH_WAIT_MS,
+                 encoder_cache=None, result_cache=None):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.encoder_cache = encoder_cache
+        self.result_cache = result_cache
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._worker = None
+        self._worker_pid = None
+
+        # Metrics
+        self._batches = 0
+        self._requests = 0
+        self._last_batch_size = 0
+        self._max_batch_size_seen = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._total_generate_time = 0.0
+        self._streams = 0
+        self._streams_cancelled = 0
+        self._total_first_token = 0.0
+        self._max_first_token = 0.0
+
+    def submit(self, prompt, max_input_length=1024, cache_key=None, cache_result=False, **generate_kwargs):
+        """Queue a prompt and return a Future resolving to the decoded text.
+
+        `prompt` is either a string or a list of token ids (see tokenize_with_shared_text).
+        Tokenization happens here, in the calling request thread, not in the batch worker.
+        `cache_key` is a (doc_id, prompt template, truncation length) tuple identifying the
+        encoder input for the encoder cache; leave it None for one-off prompts.
+        `cache_result` looks the prompt up in the result cache before doing any work.
+        """
+        result_key = None
+        if cache_result and isinstance(prompt, str):
+            result_key = self._result_key(prompt, "", max_input_length, generate_kwargs)
+        cached = self._cached_result(result_key)
+        if cached is not None:
+            return cached
+        return self._enqueue(prompt, max_input_length, cache_key, result_key, generate_kwargs)
+
+    def generate(self, prompt, max_input_length=1024, cache_key=None, cache_result=False, **generate_kwargs):
+        """Blocking helper used by the routes"""
+        return self.submit(
+            prompt, max_input_length=max_input_length, cache_key=cache_key, cache_result=cache_result,
+            **generate_kwargs
+        ).result()
+
+    def submit_shared(self, prefixes, text, max_input_length=1024, cache_keys=None, cache_result=False,
+                      **generate_kwargs):
+        """Queue several instruction prefixes over the same text, returns one Future per prefix.
+
+        Prefixes already in the result cache are answered directly; the shared text is
+        tokenized once for the remaining ones.
+        """
+        cache_keys = cache_keys or [None] * len(prefixes)
+        result_keys = [
+            self._result_key(text, prefix, max_input_length, generate_kwargs) if cache_result else None
+            for prefix in prefixes
+        ]
+        futures = [self._cached_result(key) for key in result_keys]
+
+        missing = [i for i, future in enumerate(futures) if future is None]
+        if missing:
+            prompts = self.tokenize_with_shared_text([prefixes[i] for i in missing], text, max_input_length)
+            for i, prompt in zip(missing, prompts):
+                futures[i] = self._enqueue(prompt, max_input_length, cache_keys[i], result_keys[i], generate_kwargs)
+        return futures
+
+    def stream(self, prompt, max_input_length=1024, cache_result=False, **generate_kwargs):
+        """Generate one prompt outside the batch queue, yielding decoded text pieces as they arrive.
+
+        Decoding is greedy or sampled (beam settings are dropped, streamers need a single
+        beam). With `cache_result` a cached result is yielded in one piece, and the full
+        text is stored once the stream completes within its max_time. When the caller
+        closes the generator before the end (a client disconnect), generation stops at
+        the next token instead of running to max_new_tokens.
+        """
+        # Streamers only support a single beam
+        generate_kwargs = {k: v for k, v in generate_kwargs.items() if k not in BEAM_ONLY_KWARGS}
+        result_key = self._result_key(prompt, "", max_input_length, generate_kwargs) if cache_result else None
+        cached = self._cached_result(result_key)
+        if cached is not None:
+            yield cached.result()
+            return
+
+        started = time.monotonic()
+        inputs = self.tokenizer(prompt, max_length=max_input_length, truncation=True, return_tensors="pt")
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True,
+                                        timeout=STREAM_TIMEOUT_S)
+        errors = []
+        stop = threading.Event()
+
+        def run():
+            try:
+                with torch.no_grad():
+                    self.model.generate(
+                        input_ids=inputs.input_ids.to(self.model.device),
+                        attention_mask=inputs.attention_mask.to(self.model.device),
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop)]),
+                        num_beams=1,
+                        **generate_kwargs
+                    )
+            except Exception as e:
+                logger.error(f"Streaming generation failed: {str(e)}")
+                errors.append(e)
+                streamer.end()
+
+        threading.Thread(target=run, name="inference-stream", daemon=True).start()
+
+        pieces = []
+        finished = False
+        try:
+            for piece in streamer:
+                if not piece:
+                    continue
+                if not pieces:
+                    self._record_first_token(time.monotonic() - started)
+                pieces.append(piece)
+                yield piece
+            finished = True
+        finally:
+            # Reached on GeneratorExit too, when the consumer stops reading
+            stop.set()
+            if not finished:
+                with self._condition:
+                    self._streams_cancelled += 1
+        if errors:
+            raise errors[0]
+
+        if result_key is not None and not self._reached_max_time(generate_kwargs, time.monotonic() - started):
+            self.result_cache.put(result_key, "".join(pieces))
+
+    def tokenize_with_shared_text(self, prefixes, text, max_input_length=1024):
+        """Tokenize a shared document once and prepend each instruction prefix to it.
+
+        Returns one list of token ids per prefix, truncated to max_input_length and
+        terminated with EOS, ready to pass to submit().
+        """
+        text_ids = self.tokenizer(text, add_special_tokens=False).input_ids
+        eos_id = self.tokenizer.eos_token_id
+        prompts = []
+        for prefix in prefixes:
+            prefix_ids = self.tokenizer(prefix, add_special_tokens=False).input_ids
+            prompts.append((prefix_ids + text_ids)[:max_input_length - 1] + [eos_id])
+        return prompts
+
+    def metrics(self):
+        with self._condition:
+            served = self._requests
+            return {
+                "queue_depth": len(self._pending),
+                "batches": self._batches,
+                "requests": served,
+                "last_batch_size": self._last_batch_size,
+                "max_batch_size": self._max_batch_size_seen,
+                "avg_batch_size": round(served / self._batches, 2) if self._batches else 0,
+                "avg_wait_ms": round(1000 * self._total_wait / served, 2) if served else 0,
+                "max_wait_ms": round(1000 * self._max_wait_seen, 2),
+                "avg_batch_generate_ms": round(1000 * self._total_generate_time / self._batches, 2) if self._batches else 0,
+                "streams": self._streams,
+                "streams_cancelled": self._streams_cancelled,
+                "avg_time_to_first_token_ms": round(1000 * self._total_first_token / self._streams, 2) if self._streams else 0,
+                "max_time_to_first_token_ms": round(1000 * self._max_first_token, 2),
+                "config": {
+                    "max_batch_size": self.max_batch_size,
+                    "batch_wait_ms": self.max_wait * 1000,
+                }
+            }
+
+    def _result_key(self, text, prompt, max_input_length, generate_kwargs):
+        if self.result_cache is None:
+            return None
+        # max_time only bounds how long decoding may take; complete results do not depend on it
+        params = {k: v for k, v in generate_kwargs.items() if k != 'max_time'}
+        return self.result_cache.make_key(text, prompt, dict(params, max_input_length=max_input_length))
+
+    @staticmethod
+    def _reached_max_time(generate_kwargs, elapsed):
+        # MaxTimeCriteria stops decoding once max_time has passed, so a call that ran that
+        # long may have returned a cut-off text
+        max_time = generate_kwargs.get('max_time')
+        return max_time is not None and elapsed >= max_time
+
+    def _cached_result(self, result_key):
+        # Returns a completed Future on a result cache hit, otherwise None
+        if result_key is None or self.result_cache is None:
+            return None
+        result = self.result_cache.get(result_key)
+        if result is None:
+            return None
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def _enqueue(self, prompt, max_input_length, cache_key, result_key, generate_kwargs):
+        if isinstance(prompt, str):
+            input_ids = self.tokenizer(prompt, max_length=max_input_length, truncation=True).input_ids
+        else:
+            input_ids = list(prompt)[:max_input_length]
+        item = _GenerationRequest(input_ids, max_input_length, generate_kwargs, cache_key, result_key)
+        with self._condition:
+            self._ensure_worker()
+            self._pending.append(item)
+            self._condition.notify()
+        return item.future
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so (re)start the worker lazily in each process
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        self._worker_pid = os.getpid()
+        self._worker = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._worker.start()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+
+            first = self._pending[0]
+            deadline = first.enqueued_at + self.max_wait
+            while True:
+                batch = [item for item in self._pending if item.key == first.key][:self.max_batch_size]
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            taken = set(map(id, batch))
+            self._pending = [item for item in self._pending if id(item) not in taken]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            try:
+                texts = self._generate_batch(batch)
+            except Exception as e:
+                logger.error(f"Batched generation failed ({len(batch)} requests): {str(e)}")
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+            finally:
+                self._record(batch, started)
+
+            truncated = self._reached_max_time(self._batch_kwargs(batch), time.monotonic() - started)
+            for item, text in zip(batch, texts):
+                item.future.truncated = truncated
+                item.future.set_result(text)
+            # Persist after waking the callers so cache writes never delay a response
+            if truncated:
+                continue
+            for item, text in zip(batch, texts):
+                if item.result_key is not None and self.result_cache is not None:
+                    self.result_cache.put(item.result_key, text)
+
+    @staticmethod
+    def _batch_kwargs(batch):
+        # Settings shared by the batch, with the earliest max_time of its members
+        generate_kwargs = {k: v for k, v in batch[0].generate_kwargs.items() if k != 'max_time'}
+        max_times = [item.generate_kwargs['max_time'] for item in batch if item.generate_kwargs.get('max_time')]
+        if max_times:
+            generate_kwargs['max_time'] = min(max_times)
+        return generate_kwargs
+
+    def _generate_batch(self, batch):
+        # Right-pad to the longest prompt; the attention mask hides the padding from the encoder
+        width = max(len(item.input_ids) for item in batch)
+        pad_id = self.tokenizer.pad_token_id
+        input_ids = torch.full((len(batch), width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+        for row, item in enumerate(batch):
+            input_ids[row, :len(item.input_ids)] = torch.tensor(item.input_ids, dtype=torch.long)
+            attention_mask[row, :len(item.input_ids)] = 1
+
+        device = self.model.device
+        generate_kwargs = self._batch_kwargs(batch)
+        if self.encoder_cache is not None and any(item.cache_key for item in batch):
+            output_ids = self.model.generate(
+                encoder_outputs=self._encode_with_cache(batch, input_ids, attention_mask),
+                attention_mask=attention_mask.to(device),
+                **generate_kwargs
+            )
+        else:
+            output_ids = self.model.generate(
+                input_ids=input_ids.to(device),
+                attention_mask=attention_mask.to(device),
+                **generate_kwargs
+            )
+        return self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+    def _encode_with_cache(self, batch, input_ids, attention_mask):
+        """Build padded encoder outputs, running the encoder only for rows not in the cache"""
+        device = self.model.device
+        hidden = [
+            self.encoder_cache.get(item.cache_key) if item.cache_key else None
+            for item in batch
+        ]
+
+        missing = [row for row, states in enumerate(hidden) if states is None]
+        if missing:
+            width = max(len(batch[row].input_ids) for row in missing)
+            with torch.no_grad():
+                encoded = self.model.get_encoder()(
+                    input_ids=input_ids[missing, :width].to(device),
+                    attention_mask=attention_mask[missing, :width].to(device)
+                ).last_hidden_state
+            for i, row in enumerate(missing):
+                hidden[row] = encoded[i, :len(batch[row].input_ids)]
+                if batch[row].cache_key:
+                    self.encoder_cache.put(batch[row].cache_key, hidden[row])
+
+        # Padding positions are zero and masked out of cross-attention
+        width = input_ids.shape[1]
+        last_hidden_state = torch.zeros(
+            (len(batch), width, hidden[0].shape[-1]),
+            dtype=hidden[0].dtype,
+            device=device
+        )
+        for row, states in enumerate(hidden):
+            last_hidden_state[row, :states.shape[0]] = states.to(device)
+        return BaseModelOutput(last_hidden_state=last_hidden_state)
+
+    def _record(self, batch, started):
+        elapsed = time.monotonic() - started
+        with self._condition:
+            self._batches += 1
+            self._requests += len(batch)
+            self._last_batch_size = len(batch)
+            self._max_batch_size_seen = max(self._max_batch_size_seen, len(batch))
+            self._total_generate_time += elapsed
+            for item in batch:
+                waited = started - item.enqueued_at
+                self._total_wait += waited
+                self._max_wait_seen = max(self._max_wait_seen, waited)
+
+    def _record_first_token(self, elapsed):
+        with self._condition:
+            self._streams += 1
+            self._total_first_token += elapsed
+            self._max_first_token = max(self._max_first_token, elapsed)
@@ -0,0 +1,162 @@
+import os
+import uuid
+import threading
+import logging
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from mongo_indexes import ensure_ttl_index
+
+logger = logging.getLogger(__name__)
+
+# Ingestion worker pool configuration, overridable from the environment
+INGESTION_WORKERS = int(os.environ.get('INGESTION_WORKERS', 2))
+INGESTION_MAX_JOBS_IN_MEMORY = int(os.environ.get('INGESTION_MAX_JOBS_IN_MEMORY', 1000))
+# Finished jobs are removed from MongoDB this long after completing (0 keeps them forever)
+INGESTION_JOB_TTL_S = int(os.environ.get('INGESTION_JOB_TTL_S', 24 * 3600))
+
+
+class IngestionJobs:
+    """Runs document ingestion in a background worker pool and tracks per-stage progress.
+
+    Job state is kept in memory and mirrored to an optional MongoDB collection so
+    that /jobs/<id> can be answered by any worker process. Completed and failed jobs
+    get a completedAt time, and a TTL index on it drops them from MongoDB after
+    ttl_seconds; queued and running jobs have none and are kept.
+    """
+
+    def __init__(self, mongo_collection=None, max_workers=INGESTION_WORKERS,
+                 max_jobs_in_memory=INGESTION_MAX_JOBS_IN_MEMORY, ttl_seconds=INGESTION_JOB_TTL_S):
+        self.mongo_collection = mongo_collection
+        self.max_workers = max(1, int(max_workers))
+        self.max_jobs_in_memory = max(1, int(max_jobs_in_memory))
+        self.ttl_seconds = max(0, int(ttl_seconds))
+
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def submit(self, fn, *args, filename=None, user_id=None, content_hash=None, **kwargs):
+        """Queue fn(*args, progress=..., **kwargs) and return the new job id.
+
+        fn must return a (result, status_code) tuple like process_uploaded_document.
+        """
+        job_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+        job = {
+            "jobId": job_id,
+            "filename": filename,
+            "userId": user_id,
+            "contentHash": content_hash,
+            "status": "queued",
+            "stage": "queued",
+            "progress": None,
+            "result": None,
+            "error": None,
+            "createdAt": now,
+            "updatedAt": now,
+            "completedAt": None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.max_jobs_in_memory:
+                self._jobs.popitem(last=False)
+        self._persist(job)
+
+        self._get_executor().submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def ensure_indexes(self):
+        """Create the TTL index on finished jobs, or update its expiry if it changed"""
+        if self.mongo_collection is None or not self.ttl_seconds:
+            return
+        ensure_ttl_index(self.mongo_collection, "completedAt", self.ttl_seconds)
+
+    def in_progress(self, content_hash):
+        """Whether a queued or running job (in any worker) is ingesting a file with this content"""
+        with self._lock:
+            if any(job["contentHash"] == content_hash and job["status"] in ("queued", "running")
+                   for job in self._jobs.values()):
+                return True
+        if self.mongo_collection is None:
+            return False
+        try:
+            return self.mongo_collection.find_one(
+                {"contentHash": content_hash, "status": {"$in": ["queued", "running"]}}, {"_id": 1}
+            ) is not None
+        except Exception as e:
+            logger.warning(f"Job lookup error: {str(e)}")
+            # Unknown: report it as in use, so the caller keeps the file
+            return True
+
+    def get(self, job_id):
+        """Return a JSON-serialisable snapshot of a job, or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            job = dict(job) if job else None
+
+        if job is None and self.mongo_collection is not None:
+            try:
+                job = self.mongo_collection.find_one({"_id": job_id}, {"_id": 0})
+            except Exception as e:
+                logger.warning(f"Job lookup error: {str(e)}")
+        if job is None:
+            return None
+
+        for field in ("createdAt", "updatedAt", "completedAt"):
+            if isinstance(job.get(field), datetime):
+                job[field] = job[field].isoformat()
+        return job
+
+    def _get_executor(self):
+        # Pools do not survive a fork, so create one lazily in each worker process
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingestion")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job["updatedAt"] = datetime.utcnow()
+            if job["status"] in ("completed", "failed"):
+                job["completedAt"] = job["updatedAt"]
+            snapshot = dict(job)
+        self._persist(snapshot)
+
+    def _run(self, job_id, fn, args, kwargs):
+        def progress(stage, current=None, total=None):
+            self._update(
+                job_id,
+                stage=stage,
+                progress={"current": current, "total": total} if total else None
+            )
+
+        self._update(job_id, status="running", stage="starting")
+        try:
+            result, status_code = fn(*args, progress=progress, **kwargs)
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+            logger.error(traceback.format_exc())
+            self._update(job_id, status="failed", stage="failed", error=str(e))
+            return
+
+        if status_code == 200:
+            self._update(job_id, status="completed", stage="done", progress=None, result=result)
+        else:
+            self._update(job_id, status="failed", stage="failed", error=result.get("error"), result=result)
+
+    def _persist(self, job):
+        if self.mongo_collection is None:
+            return
+        try:
+            self.mongo_collection.replace_one({"_id": job["jobId"]}, dict(job, _id=job["jobId"]), upsert=True)
+        except Exception as e:
+            logger.warning(f"Job status write error: {str(e)}")
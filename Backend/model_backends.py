@@ -0,0 +1,76 @@
+import os
+import time
+import logging
+
+import torch
+from transformers import T5Tokenizer, T5ForConditionalGeneration
+
+logger = logging.getLogger(__name__)
+
+# Inference backend configuration, overridable from the environment
+MODEL_NAME = os.environ.get('MODEL_NAME', 'google/flan-t5-base')
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'pytorch')
+ONNX_MODEL_DIR = os.environ.get('ONNX_MODEL_DIR', 'onnx_models')
+
+BACKENDS = ('pytorch', 'int8', 'onnx')
+
+
+def load_pytorch(model_name):
+    """The original fp32 model, placed by accelerate's device map"""
+    return T5ForConditionalGeneration.from_pretrained(model_name, device_map="auto")
+
+
+def load_int8(model_name):
+    """fp32 weights with every nn.Linear swapped for a dynamically quantized int8 Linear (CPU only)"""
+    model = T5ForConditionalGeneration.from_pretrained(model_name)
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_onnx(model_name, export_dir=ONNX_MODEL_DIR):
+    """Encoder/decoder exported to ONNX with KV-cache, run under ONNX Runtime.
+
+    The export is written once to `export_dir` and reused on later starts.
+    """
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise RuntimeError("The onnx backend requires optimum[onnxruntime]") from e
+
+    path = os.path.join(export_dir, model_name.replace('/', '--'))
+    if os.path.isdir(path):
+        return ORTModelForSeq2SeqLM.from_pretrained(path, use_cache=True)
+
+    logger.info(f"Exporting {model_name} to ONNX in {path}...")
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, use_cache=True)
+    model.save_pretrained(path)
+    return model
+
+
+_LOADERS = {'pytorch': load_pytorch, 'int8': load_int8, 'onnx': load_onnx}
+
+
+def supports_encoder_cache(backend):
+    # The encoder cache feeds torch hidden states back into generate(); ONNX Runtime
+    # runs its own encoder session, so the cache is skipped for that backend
+    return backend != 'onnx'
+
+
+def load_tokenizer(model_name=MODEL_NAME):
+    return T5Tokenizer.from_pretrained(model_name)
+
+
+def load_model(model_name=MODEL_NAME, backend=INFERENCE_BACKEND):
+    """Return the generation model for the selected backend"""
+    if backend not in _LOADERS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {', '.join(BACKENDS)}")
+    return _LOADERS[backend](model_name)
+
+
+def load_generation_model(model_name=MODEL_NAME, backend=INFERENCE_BACKEND):
+    """Return (tokenizer, model) for the selected backend"""
+    started = time.monotonic()
+    tokenizer = load_tokenizer(model_name)
+    model = load_model(model_name, backend)
+    logger.info(f"Loaded {model_name} with the {backend} backend in {time.monotonic() - started:.1f}s")
+    return tokenizer, model
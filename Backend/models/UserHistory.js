@@ -15,6 +15,11 @@ const UserHistorySchema = new mongoose.Schema({
     type: String,
     required: true,
   },
+  contentHash: {
+    type: String,
+    index: true,
+  },
+  storedFile: String,
   timestamp: {
     type: Date,
     default: Date.now,
@@ -0,0 +1,23 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_ttl_index(collection, field, expire_after_seconds):
+    """Expire documents of `collection` expire_after_seconds after the datetime in `field`.
+
+    The index is named "<field>_ttl". When it already exists with another expiry, it is
+    changed in place with collMod instead of being dropped and rebuilt. Documents
+    without the field never expire.
+    """
+    name = f"{field}_ttl"
+    try:
+        collection.create_index(field, name=name, expireAfterSeconds=expire_after_seconds)
+    except Exception:
+        try:
+            collection.database.command(
+                "collMod", collection.name,
+                index={"name": name, "expireAfterSeconds": expire_after_seconds}
+            )
+        except Exception as e:
+            logger.warning(f"TTL index error on {collection.name}.{field}: {str(e)}")
@@ -0,0 +1,43 @@
+import re
+
+# Same URLs as the old clean_text pattern (http\S+|www\S+|https\S+), compiled once
+_URL = re.compile(r'(?:http|www)\S+')
+# Terminal punctuation followed by whitespace or the end of the text
+_SENTENCE_END = re.compile(r'[.!?]+(?=\s|$)')
+_NON_SPACE = re.compile(r'\S')
+
+
+def collapse_whitespace(text):
+    """Collapse every run of whitespace to one space and strip the ends, like re.sub(r'\\s+', ' ', text).strip()"""
+    return ' '.join(text.split())
+
+
+def normalize_text(text, limit=None):
+    """Drop URLs and collapse all whitespace to single spaces, optionally truncating.
+
+    Equivalent to the regex passes it replaces, but the whitespace pass is one
+    str.split/join and the URL pass only runs on texts that can contain a URL.
+    """
+    if 'http' in text or 'www' in text:
+        text = _URL.sub('', text)
+    text = collapse_whitespace(text)
+    return text[:limit] if limit is not None else text
+
+
+def sentence_spans(text):
+    """(start, end) of every sentence: from a non-space character to terminal punctuation
+    followed by whitespace, or to the end of the text"""
+    spans = []
+    position = 0
+    length = len(text)
+    while position < length:
+        start = _NON_SPACE.search(text, position)
+        if start is None:
+            break
+        start = start.start()
+        # A sentence has at least one character before its terminator
+        end = _SENTENCE_END.search(text, start + 1)
+        end = end.end() if end is not None else length
+        spans.append((start, end))
+        position = end
+    return spans
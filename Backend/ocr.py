@@ -0,0 +1,224 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pytesseract
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from ocr_cache import OCRCache
+
+logger = logging.getLogger(__name__)
+
+# OCR configuration, overridable from the environment
+OCR_DPI = int(os.environ.get('OCR_DPI', 300))
+OCR_CONFIG = os.environ.get('OCR_CONFIG', r'--oem 3 --psm 1')
+# OCR_WORKERS and OCR_MEMORY_LIMIT_MB are host-wide: each of the SERVER_WORKERS processes
+# (gunicorn.conf.py exports GUNICORN_WORKERS) gets an equal share of the threads and memory
+SERVER_WORKERS = max(1, int(os.environ.get('GUNICORN_WORKERS', 1)))
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1))
+# - disk: pages are rasterized into a temp directory and tesseract reads the files itself,
+#   so no page bitmap is ever held in this process
+# - memory: pages are rasterized into PIL images, as before
+OCR_RASTER_MODE = os.environ.get('OCR_RASTER_MODE', 'disk')
+OCR_TMP_DIR = os.environ.get('OCR_TMP_DIR') or None
+# Ceiling on the estimated memory of pages being rasterized and OCR'd at once on the host,
+# and the estimate per page pixel (the 8-bit bitmap plus tesseract's working copies of it)
+OCR_MEMORY_LIMIT_MB = int(os.environ.get('OCR_MEMORY_LIMIT_MB', 1024))
+OCR_BYTES_PER_PIXEL = float(os.environ.get('OCR_BYTES_PER_PIXEL', 4))
+# This process's share
+OCR_PROCESS_WORKERS = max(1, OCR_WORKERS // SERVER_WORKERS)
+OCR_PROCESS_MEMORY_LIMIT_MB = OCR_MEMORY_LIMIT_MB / SERVER_WORKERS
+
+# Each page gets its own tesseract process; keep them single-threaded so that
+# OCR_WORKERS processes across the host map onto OCR_WORKERS cores instead of oversubscribing.
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    # The pool only drives pdftoppm/tesseract subprocesses, so threads are enough to
+    # keep every core busy; it is shared by all uploads so total OCR concurrency
+    # stays bounded. Pools do not survive a fork, so create one per process.
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=OCR_PROCESS_WORKERS, thread_name_prefix="ocr")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+class MemoryBudget:
+    """Admits work only while the sum of its estimated bytes stays under a ceiling.
+
+    Callers that do not fit wait until running work releases its reservation. A single
+    reservation larger than the whole budget is let through once nothing else runs,
+    so an oversized page is processed alone instead of never.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit = max(1, int(limit_bytes))
+        self._used = 0
+        self._peak = 0
+        self._waits = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        nbytes = min(max(0, int(nbytes)), self.limit)
+        with self._condition:
+            if self._used + nbytes > self.limit:
+                self._waits += 1
+                self._condition.wait_for(lambda: self._used + nbytes <= self.limit)
+            self._used += nbytes
+            self._peak = max(self._peak, self._used)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._used -= nbytes
+                self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "limit_mb": round(self.limit / (1024 * 1024), 1),
+                "reserved_mb": round(self._used / (1024 * 1024), 1),
+                "peak_reserved_mb": round(self._peak / (1024 * 1024), 1),
+                "waits": self._waits
+            }
+
+
+# Shared by all uploads in this process, like the pool
+memory_budget = MemoryBudget(OCR_PROCESS_MEMORY_LIMIT_MB * 1024 * 1024)
+
+# Text of every page OCR'd before, keyed by its bitmap, so re-uploaded scans skip tesseract
+ocr_cache = OCRCache()
+_tesseract_version = None
+
+
+def recognize(image, page_digest, dpi=OCR_DPI, config=OCR_CONFIG):
+    """Run tesseract on a page image (file path or PIL image) unless the cache has its text"""
+    global _tesseract_version
+    if _tesseract_version is None:
+        _tesseract_version = str(pytesseract.get_tesseract_version())
+
+    key = ocr_cache.make_key(page_digest, dpi, config, _tesseract_version)
+    text = ocr_cache.get(key)
+    if text is None:
+        started = time.monotonic()
+        text = pytesseract.image_to_string(image, config=config)
+        ocr_cache.put(key, text, time.monotonic() - started)
+    return text
+
+
+def count_pdf_pages(file_path):
+    return int(pdfinfo_from_path(file_path)["Pages"])
+
+
+def estimate_page_bytes(file_path, dpi=OCR_DPI):
+    """Estimated peak memory of rasterizing and OCR'ing one page, from the first page's size"""
+    try:
+        # "612 x 792 pts (letter)"
+        width, _, height = pdfinfo_from_path(file_path)["Page size"].split()[:3]
+        pixels = (float(width) * dpi / 72) * (float(height) * dpi / 72)
+    except Exception:
+        pixels = (8.5 * dpi) * (11 * dpi)
+    return int(pixels * OCR_BYTES_PER_PIXEL)
+
+
+def ocr_page(file_path, page_number, dpi=OCR_DPI, config=OCR_CONFIG):
+    """Rasterize and OCR one 1-based page with the configured OCR_RASTER_MODE"""
+    if OCR_RASTER_MODE == 'memory':
+        return ocr_page_in_memory(file_path, page_number, dpi, config)
+    return ocr_page_on_disk(file_path, page_number, dpi, config)
+
+
+def ocr_page_on_disk(file_path, page_number, dpi=OCR_DPI, config=OCR_CONFIG):
+    """Rasterize one 1-based page to a temporary file and let tesseract read it from there"""
+    with tempfile.TemporaryDirectory(prefix="ocr-", dir=OCR_TMP_DIR) as folder:
+        paths = convert_from_path(
+            file_path,
+            dpi=dpi,
+            grayscale=True,
+            first_page=page_number,
+            last_page=page_number,
+            thread_count=1,
+            output_folder=folder,
+            paths_only=True
+        )
+        if not paths:
+            return ""
+        digest = hashlib.sha256()
+        with open(paths[0], 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        return recognize(paths[0], digest.hexdigest(), dpi, config)
+
+
+def ocr_page_in_memory(file_path, page_number, dpi=OCR_DPI, config=OCR_CONFIG):
+    """Rasterize and OCR one 1-based page; only that page's bitmap is ever in memory"""
+    images = convert_from_path(
+        file_path,
+        dpi=dpi,
+        grayscale=True,
+        first_page=page_number,
+        last_page=page_number,
+        thread_count=1
+    )
+    if not images:
+        return ""
+    try:
+        image = images[0]
+        digest = hashlib.sha256(f"{image.mode}{image.size}".encode('utf-8'))
+        digest.update(image.tobytes())
+        return recognize(image, digest.hexdigest(), dpi, config)
+    finally:
+        images[0].close()
+
+
+def ocr_pages(file_path, page_numbers, progress=None):
+    """OCR the given 1-based pages in parallel and return {page_number: text}"""
+    page_numbers = list(page_numbers)
+    if not page_numbers:
+        return {}
+
+    # Pages only start once their estimated memory fits under the shared ceiling
+    page_bytes = estimate_page_bytes(file_path)
+
+    def run(page_number):
+        with memory_budget.reserve(page_bytes):
+            return ocr_page(file_path, page_number)
+
+    pool = _get_pool()
+    futures = {pool.submit(run, page_number): page_number for page_number in page_numbers}
+
+    results = {}
+    for done, future in enumerate(as_completed(futures), start=1):
+        page_number = futures[future]
+        try:
+            results[page_number] = future.result()
+        except Exception as e:
+            logger.warning(f"OCR error on page {page_number}: {str(e)}")
+            results[page_number] = ""
+        if progress:
+            progress("ocr", done, len(page_numbers))
+    return results
+
+
+def ocr_stats():
+    return {
+        "raster_mode": OCR_RASTER_MODE,
+        "workers": OCR_PROCESS_WORKERS,
+        "host_workers": OCR_WORKERS,
+        "host_memory_limit_mb": OCR_MEMORY_LIMIT_MB,
+        "memory": memory_budget.stats(),
+        "cache": ocr_cache.stats()
+    }
@@ -0,0 +1,153 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# OCR cache configuration, overridable from the environment
+OCR_CACHE_PATH = os.environ.get('OCR_CACHE_PATH', 'ocr_cache.sqlite3')
+OCR_CACHE_MAX_MB = float(os.environ.get('OCR_CACHE_MAX_MB', 256))
+# Writes between exact size checks, which also pick up what other workers stored
+OCR_CACHE_RESYNC_PUTS = int(os.environ.get('OCR_CACHE_RESYNC_PUTS', 256))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used);
+"""
+
+
+class OCRCache:
+    """Persistent cache of OCR text per rasterized page, in SQLite.
+
+    Keys are a SHA-256 over (page bitmap digest, dpi, tesseract config and version), so
+    a page seen before in any document skips tesseract. Each entry keeps the seconds
+    tesseract took for it, which a hit adds to `saved_seconds`. When the stored text
+    exceeds max_bytes the least recently used entries are evicted. The database file is
+    shared by all workers; connections are per process.
+
+    Each process keeps a running total of the stored size instead of summing the table
+    on every write. It is exact only for this process's own writes, so the table is
+    summed again every resync_puts writes and whenever the total crosses max_bytes.
+    """
+
+    def __init__(self, path=OCR_CACHE_PATH, max_bytes=OCR_CACHE_MAX_MB * 1024 * 1024,
+                 resync_puts=OCR_CACHE_RESYNC_PUTS):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self.resync_puts = max(1, int(resync_puts))
+
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._size = None
+        self._puts_since_sync = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def make_key(page_digest, dpi, config, engine=""):
+        return hashlib.sha256(f"{page_digest}\x00{dpi}\x00{config}\x00{engine}".encode('utf-8')).hexdigest()
+
+    def _connect(self):
+        # SQLite connections must not cross a fork, so each process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+            self._size = None
+        return self._connection
+
+    def get(self, key):
+        """Return the cached text of a page, or None"""
+        try:
+            with self._lock:
+                connection = self._connect()
+                row = connection.execute("SELECT text, seconds FROM pages WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                with connection:
+                    connection.execute("UPDATE pages SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.hits += 1
+                self.saved_seconds += row[1]
+                return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"OCR cache lookup error: {str(e)}")
+            return None
+
+    def put(self, key, text, seconds):
+        try:
+            size = len(text.encode('utf-8'))
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO pages (key, text, size, seconds, last_used) VALUES (?, ?, ?, ?, ?)",
+                        (key, text, size, seconds, time.time())
+                    )
+                    # A replaced entry is counted twice until the next resync, which only evicts early
+                    if self._size is not None:
+                        self._size += size
+                    self._puts_since_sync += 1
+                    if (self._size is None or self._size > self.max_bytes
+                            or self._puts_since_sync >= self.resync_puts):
+                        self._evict(connection)
+        except sqlite3.Error as e:
+            logger.warning(f"OCR cache write error: {str(e)}")
+
+    def _evict(self, connection):
+        # Caller holds the lock; brings the running total back to the table's exact size
+        (total,) = connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()
+        self._size = total
+        self._puts_since_sync = 0
+        if total <= self.max_bytes:
+            return
+        # Evict down to 90% of the cap so a full cache does not evict on every write
+        excess = total - int(self.max_bytes * 0.9)
+        evicted = 0
+        for key, size in connection.execute("SELECT key, size FROM pages ORDER BY last_used").fetchall():
+            if excess <= 0:
+                break
+            connection.execute("DELETE FROM pages WHERE key = ?", (key,))
+            excess -= size
+            self._size -= size
+            evicted += 1
+        self.evictions += evicted
+
+    def stats(self):
+        try:
+            with self._lock:
+                entries, size = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages"
+                ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "size_mb": round(size / (1024 * 1024), 2) if size is not None else None,
+            "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            # tesseract runs single-threaded (OMP_THREAD_LIMIT=1), so its seconds are CPU seconds
+            "saved_cpu_seconds": round(self.saved_seconds, 1)
+        }
@@ -0,0 +1,99 @@
+import os
+import re
+import hashlib
+import threading
+import logging
+from collections import OrderedDict, defaultdict
+
+from retrieval import BM25Index
+
+logger = logging.getLogger(__name__)
+
+# Vector partitioning configuration, overridable from the environment
+PARTITION_PREFIX = os.environ.get('PARTITION_PREFIX', 'user_')
+PARTITION_CACHE_SIZE = int(os.environ.get('PARTITION_CACHE_SIZE', 256))
+
+_SAFE_ID = re.compile(r'[A-Za-z0-9]{1,56}')
+
+
+class UserPartitions:
+    """One vector collection and one BM25 keyword index per user.
+
+    Searches only ever touch the calling user's vectors, so cost no longer grows
+    with the total number of users and documents. Collection handles and keyword
+    indexes of the `cache_size` most recently active users are kept in memory.
+    """
+
+    def __init__(self, client, metadata=None, prefix=PARTITION_PREFIX, cache_size=PARTITION_CACHE_SIZE):
+        self.client = client
+        self.metadata = metadata or {}
+        self.prefix = prefix
+        self.cache_size = max(1, int(cache_size))
+
+        self._partitions = OrderedDict()  # user_id -> (collection, BM25Index)
+        self._lock = threading.Lock()
+
+    def name(self, user_id):
+        # Chroma collection names allow 3-63 characters; ObjectId hex strings are used
+        # as-is, anything else is hashed
+        user_id = str(user_id)
+        if not _SAFE_ID.fullmatch(user_id):
+            user_id = hashlib.sha1(user_id.encode('utf-8')).hexdigest()
+        return f"{self.prefix}{user_id}"
+
+    def collection(self, user_id):
+        return self._get(user_id)[0]
+
+    def keyword_index(self, user_id, sync=False):
+        """The user's BM25 index.
+
+        Documents are loaded into it on demand when a search names them. With `sync`
+        the whole index is reloaded if its chunk count differs from the collection's,
+        e.g. after uploads or deletes handled by another worker process.
+        """
+        collection, index = self._get(user_id)
+        if sync and len(index) != collection.count():
+            self._reload(collection, index)
+        return index
+
+    def stats(self):
+        with self._lock:
+            indexes = [index for _, index in self._partitions.values()]
+        return {
+            "users_in_memory": len(indexes),
+            "keyword_chunks": sum(len(index) for index in indexes)
+        }
+
+    def _get(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            partition = self._partitions.get(user_id)
+            if partition is not None:
+                self._partitions.move_to_end(user_id)
+                return partition
+
+        collection = self.client.get_or_create_collection(name=self.name(user_id), metadata=self.metadata)
+        index = BM25Index(loader=lambda doc_id: self._load_document(collection, doc_id))
+
+        with self._lock:
+            partition = self._partitions.setdefault(user_id, (collection, index))
+            self._partitions.move_to_end(user_id)
+            while len(self._partitions) > self.cache_size:
+                self._partitions.popitem(last=False)
+            return partition
+
+    @staticmethod
+    def _load_document(collection, doc_id):
+        results = collection.get(where={"doc_id": doc_id}, include=["documents"])
+        return results['ids'], results['documents']
+
+    @staticmethod
+    def _reload(collection, index):
+        results = collection.get(include=["documents", "metadatas"])
+        by_document = defaultdict(lambda: ([], []))
+        for chunk_id, document, metadata in zip(results['ids'], results['documents'], results['metadatas']):
+            chunk_ids, texts = by_document[metadata.get('doc_id')]
+            chunk_ids.append(chunk_id)
+            texts.append(document)
+        index.rebuild((doc_id, chunk_ids, texts) for doc_id, (chunk_ids, texts) in by_document.items())
+        logger.info(f"Reloaded keyword index for '{collection.name}': {len(index)} chunks")
@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+from mongo_indexes import ensure_ttl_index
+from normalization import collapse_whitespace
+
+logger = logging.getLogger(__name__)
+
+# Result cache configuration, overridable from the environment
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 2048))
+# Persisted results expire this long after they were written (0 keeps them forever)
+RESULT_CACHE_TTL_S = int(os.environ.get('RESULT_CACHE_TTL_S', 7 * 24 * 3600))
+
+
+class ResultCache:
+    """Content-addressed cache of generated summaries and answers.
+
+    Keys are a SHA-256 over (normalized input text, prompt, generation parameters,
+    model id), so identical requests are served without tokenizing anything. An
+    in-process LRU sits in front of an optional MongoDB collection that survives
+    restarts and is shared between workers. MongoDB removes persisted results
+    ttl_seconds after they were written, via a TTL index on their timestamp.
+    """
+
+    def __init__(self, mongo_collection=None, model_id="", max_entries=RESULT_CACHE_MAX_ENTRIES,
+                 ttl_seconds=RESULT_CACHE_TTL_S):
+        self.mongo_collection = mongo_collection
+        self.model_id = model_id
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = max(0, int(ttl_seconds))
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+
+    def ensure_indexes(self):
+        """Create the TTL index on the persisted results, or update its expiry if it changed"""
+        if self.mongo_collection is None or not self.ttl_seconds:
+            return
+        ensure_ttl_index(self.mongo_collection, "timestamp", self.ttl_seconds)
+
+    def make_key(self, text, prompt, generation_params):
+        normalized = collapse_whitespace(text)
+        payload = json.dumps(
+            [normalized, prompt, generation_params, self.model_id],
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self.mongo_collection is not None:
+            try:
+                doc = self.mongo_collection.find_one({"_id": key}, {"result": 1})
+            except Exception as e:
+                logger.warning(f"Result cache lookup error: {str(e)}")
+                doc = None
+            if doc is not None:
+                with self._lock:
+                    self.mongo_hits += 1
+                    self._remember(key, doc["result"])
+                return doc["result"]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        with self._lock:
+            self._remember(key, result)
+
+        if self.mongo_collection is not None:
+            try:
+                self.mongo_collection.update_one(
+                    {"_id": key},
+                    {"$set": {
+                        "result": result,
+                        "modelId": self.model_id,
+                        "timestamp": datetime.utcnow()
+                    }},
+                    upsert=True
+                )
+            except Exception as e:
+                logger.warning(f"Result cache write error: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.mongo_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "mongo_hits": self.mongo_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.mongo_hits) / lookups, 3) if lookups else 0
+            }
+
+    def _remember(self, key, result):
+        # Caller holds the lock
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,148 @@
+import os
+import re
+import math
+import threading
+import logging
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Hybrid retrieval configuration, overridable from the environment
+BM25_K1 = float(os.environ.get('BM25_K1', 1.2))
+BM25_B = float(os.environ.get('BM25_B', 0.75))
+RRF_K = int(os.environ.get('RRF_K', 60))
+
+# Words, plus dotted numbers such as section "3.2.1" kept as a single term
+_TERM = re.compile(r'[0-9]+(?:\.[0-9]+)+|\w+')
+
+
+def tokenize(text):
+    return _TERM.findall(text.lower())
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked id lists into one [(id, score)] list, best first"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """In-process inverted index over chunk text, scored with Okapi BM25.
+
+    Chunks are grouped by document so a search can be restricted to a set of
+    documents. Documents missing from the index (e.g. ingested by another worker
+    process, or before a restart) are pulled in on first use through
+    `loader(doc_id) -> (chunk_ids, texts)`.
+    """
+
+    def __init__(self, loader=None, k1=BM25_K1, b=BM25_B):
+        self.loader = loader
+        self.k1 = k1
+        self.b = b
+
+        self._postings = defaultdict(dict)  # term -> {chunk_id: term frequency}
+        self._lengths = {}                   # chunk_id -> number of terms
+        self._doc_chunks = {}                # doc_id -> [chunk_id]
+        self._doc_terms = {}                 # doc_id -> terms used by its chunks
+        self._chunk_doc = {}                 # chunk_id -> doc_id
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, doc_id, chunk_ids, texts):
+        with self._lock:
+            self.remove(doc_id)
+            doc_terms = set()
+            for chunk_id, text in zip(chunk_ids, texts):
+                terms = Counter(tokenize(text))
+                doc_terms.update(terms)
+                for term, frequency in terms.items():
+                    self._postings[term][chunk_id] = frequency
+                length = sum(terms.values())
+                self._lengths[chunk_id] = length
+                self._chunk_doc[chunk_id] = doc_id
+                self._total_length += length
+            self._doc_chunks[doc_id] = list(chunk_ids)
+            self._doc_terms[doc_id] = doc_terms
+
+    def rebuild(self, documents):
+        """Replace the whole index with (doc_id, chunk_ids, texts) entries"""
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._doc_chunks.clear()
+            self._doc_terms.clear()
+            self._chunk_doc.clear()
+            self._total_length = 0
+            for doc_id, chunk_ids, texts in documents:
+                self.add(doc_id, chunk_ids, texts)
+
+    def remove(self, doc_id):
+        with self._lock:
+            chunk_ids = self._doc_chunks.pop(doc_id, None)
+            doc_terms = self._doc_terms.pop(doc_id, ())
+            if not chunk_ids:
+                return
+            for chunk_id in chunk_ids:
+                self._total_length -= self._lengths.pop(chunk_id, 0)
+                self._chunk_doc.pop(chunk_id, None)
+            for term in doc_terms:
+                postings = self._postings[term]
+                for chunk_id in chunk_ids:
+                    postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query, doc_ids=None, limit=20):
+        """Return up to `limit` [(chunk_id, score)] for the query, best first"""
+        if doc_ids is not None:
+            doc_ids = set(doc_ids)
+            for doc_id in doc_ids:
+                self._ensure_loaded(doc_id)
+
+        terms = set(tokenize(query))
+        with self._lock:
+            if not self._lengths or not terms:
+                return []
+            count = len(self._lengths)
+            average_length = self._total_length / count
+
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, frequency in postings.items():
+                    if doc_ids is not None and self._chunk_doc[chunk_id] not in doc_ids:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / average_length)
+                    scores[chunk_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._doc_chunks),
+                "chunks": len(self._lengths),
+                "terms": len(self._postings)
+            }
+
+    def _ensure_loaded(self, doc_id):
+        with self._lock:
+            if doc_id in self._doc_chunks or self.loader is None:
+                return
+        try:
+            chunk_ids, texts = self.loader(doc_id)
+        except Exception as e:
+            logger.warning(f"BM25 load error for {doc_id}: {str(e)}")
+            return
+        with self._lock:
+            if doc_id not in self._doc_chunks:
+                self.add(doc_id, chunk_ids, texts)
@@ -5,6 +5,8 @@ const dotenv = require("dotenv");
 const path = require("path");
 const fs = require("fs");
 const axios = require("axios"); // Add axios for making HTTP requests to Flask
+const FormData = require("form-data");
+const fileUpload = require("express-fileupload");
 const UserHistory = require('./models/UserHistory');
 const Counter = require("./models/counters");
 
@@ -102,7 +104,8 @@ const authMiddleware = (req, res, next) => {
   // and set req.user based on that token.
   // For testing purposes, setting a dummy user:
   // req.user = { _id: new mongoose.Types.ObjectId() };
-  req.user = { userId: new mongoose.Types.ObjectId("64f3e2c15f7c48c39e32a9b0") }; // Use the actual ObjectId from your database for testing
+  // Keep the _id field the routes below read
+  req.user = { _id: new mongoose.Types.ObjectId("64f3e2c15f7c48c39e32a9b0") }; // Use the actual ObjectId from your database for testing
   next();
 };
 
@@ -118,8 +121,13 @@ app.use('/api', authMiddleware);
 // --- FLASK SERVER PROXY ROUTES ---
 
 // Upload document to Flask
-app.post("/api/upload", async (req, res) => {
+// The multipart body is parsed for this route only (express-fileupload puts the file on req.files)
+app.post("/api/upload", fileUpload(), async (req, res) => {
   try {
+    if (!req.files || !req.files.file) {
+      return res.status(400).json({ error: "No file provided" });
+    }
+
     // Create a form data object to send to Flask
     const form = new FormData();
     form.append('file', req.files.file.data, {
@@ -127,7 +135,8 @@ app.post("/api/upload", async (req, res) => {
       contentType: req.files.file.mimetype
     });
 
-    // Forward the request to Flask with the user ID in headers
+    // Forward the request to Flask with the user ID in headers; Flask queues the
+    // ingestion and answers 202 with a jobId that the client polls at /api/jobs/:jobId
     const response = await axios.post(`${FLASK_SERVER_URL}/upload`, form, {
       headers: {
         ...form.getHeaders(),
@@ -143,9 +152,50 @@ app.post("/api/upload", async (req, res) => {
   }
 });
 
+// Get the status of an upload job
+app.get("/api/jobs/:jobId", async (req, res) => {
+  try {
+    const response = await axios.get(`${FLASK_SERVER_URL}/jobs/${encodeURIComponent(req.params.jobId)}`, {
+      headers: {
+        'User-ID': req.user._id.toString()
+      }
+    });
+
+    return res.status(response.status).json(response.data);
+  } catch (error) {
+    console.error("Error fetching upload job from Flask:", error);
+    return res.status(error.response?.status || 500).json(error.response?.data || { error: "Failed to fetch job status" });
+  }
+});
+
+// Pipe a streamed (server-sent events) Flask response through to the client as it arrives
+const proxyStream = async (path, req, res) => {
+  const response = await axios.post(`${FLASK_SERVER_URL}${path}`, req.body, {
+    headers: {
+      'Content-Type': 'application/json',
+      'User-ID': req.user._id.toString()
+    },
+    responseType: 'stream',
+    validateStatus: () => true
+  });
+
+  res.status(response.status);
+  res.set({
+    'Content-Type': response.headers['content-type'],
+    'Cache-Control': 'no-cache'
+  });
+  // Close the Flask stream when the client goes away, so Flask stops generating
+  res.on('close', () => response.data.destroy());
+  response.data.pipe(res);
+};
+
 // Generate summary
 app.post("/api/generate_summary", async (req, res) => {
   try {
+    if (req.body.stream === true) {
+      return await proxyStream("/generate_summary", req, res);
+    }
+
     // Forward the request to Flask with the user ID in headers
     const response = await axios.post(`${FLASK_SERVER_URL}/generate_summary`, req.body, {
       headers: {
@@ -165,6 +215,10 @@ app.post("/api/generate_summary", async (req, res) => {
 // Ask question
 app.post("/api/ask", async (req, res) => {
   try {
+    if (req.body.stream === true) {
+      return await proxyStream("/ask", req, res);
+    }
+
     // Forward the request to Flask with the user ID in headers
     const response = await axios.post(`${FLASK_SERVER_URL}/ask`, req.body, {
       headers: {
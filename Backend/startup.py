@@ -0,0 +1,165 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Startup configuration, overridable from the environment
+# - eager: models load at import; with gunicorn's preload_app that happens once in the
+#   master and forked workers share the weights copy-on-write
+# - lazy: import returns at once and components load in a background thread per worker
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'eager')
+# Components that fail to load in warm() are retried after this delay, doubling up to the maximum
+STARTUP_RETRY_MIN_S = float(os.environ.get('STARTUP_RETRY_MIN_S', 1))
+STARTUP_RETRY_MAX_S = float(os.environ.get('STARTUP_RETRY_MAX_S', 60))
+
+
+class Component:
+    """Proxy for an expensive object (model, client) that is built on first use.
+
+    Attribute access, item access and calls are passed through to the built object, so
+    the proxy's own members are underscore-prefixed to stay out of the target's way.
+    Components marked `per_process` are rebuilt in each forked worker, for clients that
+    must not be shared across a fork; the others survive a fork and are shared.
+    Components registered with a Startup are timed and count towards readiness.
+    """
+
+    def __init__(self, name, factory, per_process=False, startup=None):
+        self._name = name
+        self._startup = startup
+        self._factory = factory
+        self._per_process = per_process
+        self._target = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def _loaded(self):
+        return self._target is not None and (not self._per_process or self._pid == os.getpid())
+
+    def _resolve(self):
+        if self._loaded:
+            return self._target
+        with self._lock:
+            if not self._loaded:
+                if self._startup is not None:
+                    self._target = self._startup.measure(self._name, self._factory)
+                else:
+                    self._target = self._factory()
+                self._pid = os.getpid()
+        return self._target
+
+    def __getattr__(self, attribute):
+        return getattr(self._resolve(), attribute)
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+
+class Startup:
+    """Registry of lazily built components with per-component load timings"""
+
+    def __init__(self, mode=STARTUP_MODE):
+        if mode not in ('eager', 'lazy'):
+            raise ValueError(f"Unknown startup mode '{mode}', expected eager or lazy")
+        self.mode = mode
+        self.started = time.monotonic()
+        self._components = OrderedDict()
+        self._timings = {}  # name -> {"seconds", "pid"} or {"error"}
+        self._lock = threading.Lock()
+        self._warm_pid = None
+
+    def component(self, name, factory, per_process=False):
+        component = Component(name, factory, per_process=per_process, startup=self)
+        self._components[name] = component
+        return component
+
+    def measure(self, name, factory):
+        started = time.monotonic()
+        try:
+            target = factory()
+        except Exception as e:
+            with self._lock:
+                self._timings[name] = {"error": str(e)}
+            raise
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._timings[name] = {"seconds": round(elapsed, 3), "pid": os.getpid()}
+        logger.info(f"Startup: {name} ready in {elapsed:.2f}s")
+        return target
+
+    def load(self, names=None, shared_only=False):
+        """Build the named components (default: all) in this thread, in registration order.
+
+        A failing component does not stop the others; the first error is raised once all
+        of them were tried.
+        """
+        errors = self._load_each(names, shared_only)
+        if errors:
+            raise errors[0]
+
+    def _load_each(self, names=None, shared_only=False):
+        errors = []
+        for name, component in self._components.items():
+            if names is not None and name not in names:
+                continue
+            if shared_only and component._per_process:
+                continue
+            try:
+                component._resolve()
+            except Exception as e:
+                logger.error(f"Startup: {name} failed to load: {str(e)}")
+                errors.append(e)
+        return errors
+
+    def warm(self):
+        """Build everything not yet loaded in a background thread, once per process.
+
+        Components that fail (a store that is down at boot) are retried with exponential
+        backoff until they load, so the worker becomes ready without a restart.
+        """
+        with self._lock:
+            if self._warm_pid == os.getpid():
+                return
+            self._warm_pid = os.getpid()
+
+        def run():
+            started = time.monotonic()
+            delay = STARTUP_RETRY_MIN_S
+            while self._load_each():
+                logger.warning(f"Startup: retrying failed components in {delay:g}s (pid {os.getpid()})")
+                time.sleep(delay)
+                delay = min(delay * 2, STARTUP_RETRY_MAX_S)
+            logger.info(f"Startup: all components ready in {time.monotonic() - started:.2f}s (pid {os.getpid()})")
+
+        threading.Thread(target=run, name="startup-warmup", daemon=True).start()
+
+    @property
+    def ready(self):
+        return all(component._loaded for component in self._components.values())
+
+    def status(self):
+        with self._lock:
+            timings = dict(self._timings)
+        components = OrderedDict()
+        for name, component in self._components.items():
+            entry = dict(timings.get(name, {}))
+            if component._loaded:
+                entry["status"] = "loaded"
+            elif "error" in entry:
+                entry["status"] = "failed"
+            else:
+                entry["status"] = "pending"
+            components[name] = entry
+        return {
+            "ready": self.ready,
+            "mode": self.mode,
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.monotonic() - self.started, 3),
+            "components": components
+        }
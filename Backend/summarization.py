@@ -0,0 +1,155 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Hierarchical summarization configuration, overridable from the environment
+# Sections are measured with the chunker's WordPiece tokenizer; FLAN-T5's SentencePiece
+# produces somewhat more tokens for the same text, so 700 keeps a section plus its
+# instruction inside the 1024-token encoder window.
+SUMMARY_SECTION_TOKENS = int(os.environ.get('SUMMARY_SECTION_TOKENS', 700))
+SUMMARY_MAX_SECTIONS = int(os.environ.get('SUMMARY_MAX_SECTIONS', 48))
+SUMMARY_INPUT_TOKENS = int(os.environ.get('SUMMARY_INPUT_TOKENS', 900))
+
+SECTION_PROMPT = (
+    "Summarize this section of a document. Keep its key ideas, methods, findings and figures:\n\n"
+)
+REDUCE_PROMPT = (
+    "Combine these section summaries into one concise summary without repeating points:\n\n"
+)
+
+
+class HierarchicalSummarizer:
+    """Map-reduce summarization over a document's full cleaned text.
+
+    map: the text is split into sentence-aligned sections that fit the encoder
+    window, and every section is summarized. Sections are queued one scheduler batch
+    at a time, so they decode together and a request deadline can stop the map early.
+    reduce: section summaries are merged and, while they do not fit the requested
+    token budget, grouped and summarized again.
+    Every map and reduce step goes through the result cache keyed by its input text,
+    so re-summarizing or comparing a document reuses earlier section summaries.
+    """
+
+    def __init__(self, scheduler, splitter, max_sections=SUMMARY_MAX_SECTIONS, input_tokens=SUMMARY_INPUT_TOKENS,
+                 section_prompt=SECTION_PROMPT, reduce_prompt=REDUCE_PROMPT):
+        self.scheduler = scheduler
+        self.splitter = splitter
+        self.max_sections = max(1, int(max_sections))
+        self.input_tokens = max(1, int(input_tokens))
+        self.section_prompt = section_prompt
+        self.reduce_prompt = reduce_prompt
+
+    def sections(self, text, sentences=None):
+        """Split text into sections; very long texts keep an evenly spaced subset of them.
+
+        `sentences` are the spans and token counts recorded when the text was chunked at
+        ingestion; with them the text is not tokenized again.
+        """
+        if sentences and sentences[-1][1] <= len(text):
+            chunks = self.splitter.chunk_sentences(text, sentences)
+        else:
+            chunks = self.splitter.chunk_text(text)
+        sections = [section for section, _, _ in chunks]
+        if len(sections) > self.max_sections:
+            step = len(sections) / self.max_sections
+            sections = [sections[int(i * step)] for i in range(self.max_sections)]
+        return sections
+
+    def map(self, sections, cache_result=True, **generate_kwargs):
+        """Queue a summary of every section, returns one Future per section"""
+        return [
+            self._submit(self.section_prompt, section, cache_result, generate_kwargs)
+            for section in sections
+        ]
+
+    def summarize_sections(self, sections, deadline=None, cache_result=True, **generate_kwargs):
+        """Summarize sections in waves of one scheduler batch, stopping once `deadline` has passed.
+
+        Returns (summaries, complete): summaries of the leading sections, and whether every
+        section was summarized without any summary being cut short at its max_time.
+        """
+        summaries, complete = [], True
+        wave = self.scheduler.max_batch_size
+        for i in range(0, len(sections), wave):
+            if deadline is not None and deadline.expired:
+                logger.info(f"Request deadline reached after {i} of {len(sections)} sections")
+                return summaries, False
+            settings = deadline.apply(generate_kwargs) if deadline is not None else generate_kwargs
+            for future in self.map(sections[i:i + wave], cache_result=cache_result, **settings):
+                summaries.append(future.result())
+                complete = complete and not getattr(future, 'truncated', False)
+        return summaries, complete
+
+    def reduce(self, summaries, budget_tokens, cache_result=True, deadline=None, **generate_kwargs):
+        """Merge summaries into one text of at most budget_tokens (model tokens).
+
+        Reduce steps generate at most budget_tokens, and the result is cut to the budget
+        in tokens, so a lone section summary never overruns it either. Once `deadline`
+        has passed no more reduce steps run: every summary is cut to an equal share of
+        the budget instead.
+        """
+        budget_tokens = max(1, int(budget_tokens))
+        summaries = [summary.strip() for summary in summaries if summary and summary.strip()]
+        generate_kwargs = self._capped(generate_kwargs, budget_tokens)
+        while len(summaries) > 1:
+            combined = "\n".join(summaries)
+            if self._count(combined) <= budget_tokens:
+                return combined
+            if deadline is not None and deadline.expired:
+                share = max(1, budget_tokens // len(summaries))
+                return "\n".join(self._truncate(summary, share) for summary in summaries)
+            settings = deadline.apply(generate_kwargs) if deadline is not None else generate_kwargs
+            groups = self._groups(summaries)
+            futures = [
+                self._submit(self.reduce_prompt, "\n".join(group), cache_result, settings)
+                for group in groups
+            ]
+            summaries = [future.result().strip() for future in futures]
+        return self._truncate(summaries[0], budget_tokens) if summaries else ""
+
+    def digest(self, sections, budget_tokens, map_kwargs, reduce_kwargs, cache_result=True, deadline=None):
+        """Map then reduce: a summary of all sections (as many as the deadline allows) within budget_tokens"""
+        summaries, _ = self.summarize_sections(sections, deadline, cache_result=cache_result, **map_kwargs)
+        return self.reduce(summaries, budget_tokens, cache_result=cache_result, deadline=deadline, **reduce_kwargs)
+
+    def _submit(self, prompt, text, cache_result, generate_kwargs):
+        return self.scheduler.submit_shared(
+            [prompt], text, max_input_length=1024, cache_result=cache_result, **generate_kwargs
+        )[0]
+
+    def _count(self, text):
+        return len(self.scheduler.tokenizer(text, add_special_tokens=False).input_ids)
+
+    def _truncate(self, text, budget_tokens):
+        ids = self.scheduler.tokenizer(text, add_special_tokens=False).input_ids
+        if len(ids) <= budget_tokens:
+            return text
+        return self.scheduler.tokenizer.decode(ids[:budget_tokens], skip_special_tokens=True).strip()
+
+    @staticmethod
+    def _capped(generate_kwargs, budget_tokens):
+        # Reduce outputs longer than the budget would only be cut again
+        if generate_kwargs.get('max_length', budget_tokens + 1) <= budget_tokens:
+            return generate_kwargs
+        capped = dict(generate_kwargs, max_length=budget_tokens)
+        if capped.get('min_length', 0) > budget_tokens:
+            capped['min_length'] = budget_tokens // 2
+        return capped
+
+    def _groups(self, summaries):
+        # Pack consecutive summaries into groups that fit one reduce prompt; when nothing
+        # packs, pair them up so every round at least halves the number of summaries
+        groups, current, used = [], [], 0
+        for summary in summaries:
+            tokens = self._count(summary)
+            if current and used + tokens > self.input_tokens:
+                groups.append(current)
+                current, used = [], 0
+            current.append(summary)
+            used += tokens
+        if current:
+            groups.append(current)
+        if len(groups) == len(summaries):
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        return groups
@@ -0,0 +1,131 @@
+import os
+import uuid
+import codecs
+import hashlib
+import logging
+
+from flask import Request, current_app
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+# Upload configuration, overridable from the environment
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get('UPLOAD_MAX_FILE_BYTES', 25 * 1024 * 1024))
+UPLOAD_BLOCK_SIZE = int(os.environ.get('UPLOAD_BLOCK_SIZE', 64 * 1024))
+
+# The file type is checked once this many bytes have arrived (or at the end of shorter files)
+_SNIFF_BYTES = 1024
+
+UNSUPPORTED_TYPE = "Unsupported file type. Please upload PDF, DOCX, or TXT files."
+
+
+def _is_pdf(head):
+    # The spec allows junk before the header, readers accept it within the first 1024 bytes
+    return b'%PDF-' in head
+
+
+def _is_docx(head):
+    return head.startswith(b'PK\x03\x04')
+
+
+def _is_text(head):
+    # Extraction reads .txt files as UTF-8; the head may end inside a multi-byte character
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+    except UnicodeDecodeError:
+        return False
+    return b'\x00' not in head
+
+
+SIGNATURES = {'.pdf': _is_pdf, '.docx': _is_docx, '.txt': _is_text}
+
+
+class UploadStream:
+    """Write target for one uploaded file, used instead of werkzeug's spooled buffer.
+
+    The multipart parser writes the file's bytes here as they are read from the request
+    body. They go straight to a temporary file in the upload folder while the SHA-256 is
+    updated, and the first bytes are checked against the extension's file signature.
+    An unsupported extension, a signature mismatch or more than max_bytes sets `error`;
+    the rest of the file is then discarded as it arrives instead of being stored.
+    """
+
+    def __init__(self, folder, filename, max_bytes=UPLOAD_MAX_FILE_BYTES):
+        self.extension = os.path.splitext(secure_filename(filename or ''))[1].lower()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.error = None
+        self.path = os.path.join(folder, f".{uuid.uuid4().hex}.part")
+        self._file = open(self.path, 'wb+')
+        self._digest = hashlib.sha256()
+        self._head = b''
+        self._saved = False
+        if self.extension not in SIGNATURES:
+            self._reject(UNSUPPORTED_TYPE)
+
+    @classmethod
+    def copy_of(cls, folder, filename, stream):
+        """An UploadStream filled from a readable file object"""
+        upload = cls(folder, filename)
+        for block in iter(lambda: stream.read(UPLOAD_BLOCK_SIZE), b''):
+            upload.write(block)
+        return upload
+
+    def write(self, data):
+        if self.error is None:
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self._reject(f"File too large (max {self.max_bytes // (1024 * 1024)}MB)")
+                return len(data)
+            if len(self._head) < _SNIFF_BYTES:
+                self._head += data[:_SNIFF_BYTES - len(self._head)]
+                if len(self._head) >= _SNIFF_BYTES and not SIGNATURES[self.extension](self._head):
+                    self._reject(UNSUPPORTED_TYPE)
+                    return len(data)
+            self._digest.update(data)
+            self._file.write(data)
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence) if not self._file.closed else 0
+
+    def tell(self):
+        return self._file.tell() if not self._file.closed else 0
+
+    def read(self, size=-1):
+        return self._file.read(size) if not self._file.closed else b''
+
+    def finish(self):
+        """Complete the checks once the whole file has arrived; returns its SHA-256 hex
+        digest, or None with `error` set when the upload is rejected"""
+        if self.error is None:
+            if self.size == 0:
+                self._reject("Empty file")
+            elif not SIGNATURES[self.extension](self._head):
+                self._reject(UNSUPPORTED_TYPE)
+        return None if self.error else self._digest.hexdigest()
+
+    def save(self, path):
+        """Move the finished file to its final location"""
+        self._file.close()
+        os.replace(self.path, path)
+        self.path = path
+        self._saved = True
+
+    def close(self):
+        # Called by werkzeug when the request ends; drop anything that was never saved
+        self._file.close()
+        if not self._saved and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _reject(self, error):
+        logger.info(f"Rejecting upload ({self.extension or 'no extension'}): {error}")
+        self.error = error
+        self.close()
+
+
+class UploadRequest(Request):
+    """Flask request whose uploaded files are streamed into UploadStreams in the upload folder"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadStream(current_app.config['UPLOAD_FOLDER'], filename)
@@ -7,6 +7,7 @@ import imgLogo from "./imglogo.jpg";
 import "./ChatPage.css"; 
 
 const API_BASE_URL = "http://localhost:5000";
+const JOB_POLL_INTERVAL_MS = 2000;
 
 const ChatPage = () => {
   const navigate = useNavigate();
@@ -61,6 +62,16 @@ const ChatPage = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   };
 
+  // Poll an upload job until its ingestion finishes; returns the job's result
+  const waitForJob = async (jobId) => {
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+      const { data: job } = await axios.get(`${API_BASE_URL}/api/jobs/${jobId}`);
+      if (job.status === "completed") return job.result;
+      if (job.status === "failed") throw new Error(job.error || "Processing failed");
+    }
+  };
+
   const handleFileUpload = async (event) => {
     const file = event.target.files[0];
     if (!file) return;
@@ -82,8 +93,21 @@ const ChatPage = () => {
     setIsLoading(true);
 
     try {
-      const uploadUrl = isImage ? "/upload/image" : "/upload";
+      const uploadUrl = isImage ? "/upload/image" : "/api/upload";
       const response = await axios.post(`${API_BASE_URL}${uploadUrl}`, formData);
+
+      // Documents are processed in the background: the upload answers 202 with a job to poll.
+      // Content uploaded before is reused at once and answers 200 with the document directly.
+      if (response.status === 202 && response.data.jobId) {
+        response.data = await waitForJob(response.data.jobId);
+      }
+      if (!isImage && response.data.documentId) {
+        response.data = {
+          ...response.data,
+          doc_id: response.data.documentId,
+          source: response.data.documentTitle
+        };
+      }
       
       // Remove the uploading message
       setMessages((prev) => prev.filter(msg => msg.id !== tempId));